@@ -113,10 +113,19 @@ def static(args):
                 _walk(local, module, fullname)
             else:
                 _copy_file(module, local, fullname, fullname)
+                # Compressed copies for web servers serving them as is.
+                dst = os.path.normpath("%s/%s" % (local, fullname))
+                for compressed in nfw.compress.precompress(dst, min_size,
+                                                             types):
+                    print "Compressed %s" % (compressed,)
 
     if os.path.exists("%s/settings.cfg" % (path,)):
         config = nfw.Config("%s/settings.cfg" % (path,))
         app_config = config.get('application')
+        min_size = int(app_config.get('compress_min_size', 1024))
+        types = app_config.getitems('compress_types')
+        if len(types) == 0:
+            types = nfw.compress.TYPES
         modules = app_config.getitems('modules')
         for module in modules:
             if resource_exists(module, "static"):
@@ -58,8 +58,12 @@ from .router import Router
 from .router import view
 from .resources import Middleware
 from .resources import Resource
+from .resources import conditional
+from .resources import cached
 from .request import Request
 from .response import Response
+from . import compress
+from . import cache
 from .headers import Headers
 from . import password
 from . import app
@@ -48,6 +48,8 @@ import json
 import traceback
 import keyword
 import re
+from collections import namedtuple
+from functools import partial
 
 from jinja2 import Environment as jinja2
 from jinja2.exceptions import TemplateNotFound
@@ -56,6 +58,11 @@ import nfw
 
 log = logging.getLogger(__name__)
 
+# Per process settings resolved once at startup for the request path.
+Frozen = namedtuple('Frozen', ('debug', 'session', 'pre', 'post',
+                               'chunk_size', 'compress', 'executor'))
+Compress = namedtuple('Compress', ('min_size', 'types', 'level'))
+
 
 class Wsgi(object):
     def __init__(self):
@@ -81,7 +88,7 @@ class Wsgi(object):
 
         middleware = app_config.getitems('middleware')
         self.context = {}
-        self.router = nfw.Router()
+        self.router = nfw.Router(int(app_config.get('route_cache', 0)))
         self.modules = self._modules()
         self.views = self._objs(self.modules, nfw.Resource)
         self.middleware = self._m_objs(self.modules, middleware)
@@ -90,6 +97,48 @@ class Wsgi(object):
             self.policy = json.loads(policy)
         else:
             self.policy = None
+        self.frozen = self._freeze()
+
+    def _freeze(self):
+        app_config = self.config.get('application')
+        log_config = self.config.get('logging')
+        mysql_config = self.config.get('mysql')
+
+        debug = log_config.getboolean('debug')
+
+        session_expire = int(app_config.get('session_expire', 3600))
+        if 'redis' in self.config:
+            session = partial(nfw.SessionRedis, session_expire)
+        else:
+            session = partial(nfw.SessionFile, session_expire, 'tmp/')
+
+        if mysql_config.get('database') is not None:
+            # Registers the credentials, connections are acquired lazily
+            # on the first query of a request.
+            nfw.Mysql(**mysql_config.data)
+
+        pre = tuple(m.pre for m in self.middleware
+                    if hasattr(m, 'pre'))
+        post = tuple(m.post for m in reversed(self.middleware)
+                     if hasattr(m, 'post'))
+
+        chunk_size = int(app_config.get('chunk_size', 65536))
+
+        if app_config.getboolean('compress'):
+            types = app_config.getitems('compress_types')
+            if len(types) == 0:
+                types = nfw.compress.TYPES
+            compress = Compress(int(app_config.get('compress_min_size', 1024)),
+                                frozenset(types),
+                                int(app_config.get('compress_level', 6)))
+        else:
+            compress = None
+
+        # Worker threads are only started by requests to app.asgi().
+        executor = nfw.utils.Executor(int(app_config.get('workers', 32)))
+
+        return Frozen(debug, session, pre, post, chunk_size, compress,
+                      executor)
 
     def _error_template(self, code):
         for module in self.modules:
@@ -160,6 +209,31 @@ class Wsgi(object):
 
         return resp
 
+    def _compress(self, compress, req, resp):
+        if (resp.status not in (nfw.HTTP_200, nfw.HTTP_304) or
+                resp.has_file or 'Content-Encoding' in resp.headers):
+            return
+        content_type = resp.headers.get('Content-Type', '')
+        if content_type.split(';')[0].strip().lower() not in compress.types:
+            return
+
+        # Caches must key the response on Accept-Encoding, also when this
+        # client receives it uncompressed.
+        vary = resp.headers.get('Vary')
+        if vary is None:
+            resp.headers['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            resp.headers['Vary'] = vary + ', Accept-Encoding'
+
+        if resp.status != nfw.HTTP_200:
+            return
+        if not resp.streaming and resp.content_length < compress.min_size:
+            return
+        encoding = nfw.compress.negotiate(req.headers.get('accept_encoding',
+                                                          ''))
+        if encoding is not None:
+            resp.compress(encoding, compress.level)
+
     def _cleanup(self):
         nfw.Mysql.close_all()
 
@@ -174,24 +248,17 @@ class Wsgi(object):
         # When the method is POST the variable will be sent
         # in the HTTP request body which is passed by the WSGI server
         # in the file like wsgi.input environment variable.
-        app_config = self.config.get('application')
-        log_config = self.config.get('logging')
-        debug = log_config.getboolean('debug')
-        session_expire = app_config.get('session_expire', 3600)
+        frozen = self.frozen
+        debug = frozen.debug
 
+        # Jinja environments are per thread, only the first request
+        # on a thread creates one.
         nfw.jinja.setup()
 
-        if 'redis' in self.config:
-            session = nfw.SessionRedis(session_expire)
-        else:
-            session = nfw.SessionFile(session_expire, 'tmp/')
+        session = frozen.session()
         session_cookie = session.setup(environ)
 
-        mysql_config = self.config.get('mysql')
-        if mysql_config.get('database') is not None:
-            nfw.Mysql(**mysql_config.data)
-
-        resp = nfw.Response()
+        resp = nfw.Response(frozen.chunk_size)
         req = nfw.Request(environ, self.config, session, self.router, self.logger, self)
 
         resp.headers['Set-Cookie'] = session_cookie
@@ -208,7 +275,7 @@ class Wsgi(object):
             nfw.jinja.globals['SITE'] = req.environ['SCRIPT_NAME']
             nfw.jinja.globals['REQUEST'] = req
             if nfw.jinja.globals['SITE'] == '/':
-                jinja.globals['SITE'] = ''
+                nfw.jinja.globals['SITE'] = ''
 
         returned = None
         try:
@@ -224,22 +291,38 @@ class Wsgi(object):
                                     qwargs=req.query)
                 req.policy = policy
 
-            for m in self.middleware:
-                if hasattr(m, 'pre'):
-                    m.pre(req, resp)
+            for pre in frozen.pre:
+                pre(req, resp)
 
             if r is not None:
                 if policy.validate(req.view):
-                    returned = obj(req, resp, **obj_kwargs)
+                    validator = getattr(obj, 'validator', None)
+                    if validator is not None and req.method == nfw.HTTP_GET:
+                        validator(req, resp, **obj_kwargs)
+                        if resp.conditional(req.headers):
+                            # Not modified, the view is not run.
+                            obj = None
+                    cache = getattr(obj, 'response_cache', None)
+                    if cache is not None and req.method == nfw.HTTP_GET:
+                        returned = cache.respond(obj, req, resp, obj_kwargs)
+                    elif obj is not None:
+                        returned = obj(req, resp, **obj_kwargs)
                 else:
                     raise nfw.HTTPForbidden('Access Forbidden',
                                             'Access denied by system policy')
             else:
                 raise nfw.HTTPNotFound(description=req.environ['PATH_INFO'])
 
-            for m in reversed(self.middleware):
-                if hasattr(m, 'post'):
-                    m.post(req, resp)
+            for post in frozen.post:
+                post(req, resp)
+
+            if returned is None and req.method == nfw.HTTP_GET:
+                if not resp.conditional(req.headers) and 'range' in req.headers:
+                    resp.range(req.headers['range'],
+                               req.headers.get('if_range'))
+
+            if returned is None and frozen.compress is not None:
+                self._compress(frozen.compress, req, resp)
 
         except nfw.HTTPError as e:
             trace = str(traceback.format_exc())
@@ -262,18 +345,27 @@ class Wsgi(object):
             h = (header, value)
             response_headers.append(h)
 
-        if returned is None:
+        # Without a Content-Length the server sends the body chunked.
+        if returned is None and resp.content_length is not None:
             response_headers.append(('Content-Length'.encode('utf-8'),
                                      str(resp.content_length).encode('utf-8')))
 
         # Send status and headers to the server using the supplied function
         start_response(resp.status, response_headers)
 
-        self._cleanup()
-
         if returned is not None:
-            return returned
+            # Views returning their own iterable may still be reading
+            # from the database while the server iterates.
+            return nfw.response.ResponseClose(returned, self._cleanup)
+        elif resp.streaming:
+            return nfw.response.ResponseClose(resp, self._cleanup)
+        elif resp.has_file:
+            self._cleanup()
+            # Returned as is, servers only use sendfile for their own
+            # file wrapper.
+            return resp.file_body(environ.get('wsgi.file_wrapper'))
         else:
+            self._cleanup()
             return resp
 
     def _modules(self):
@@ -331,3 +423,91 @@ class Wsgi(object):
     def application(self):
         # Return the application interface method as a callable object
         return self._interface
+
+    def _environ(self, scope, body):
+        # WSGI environment for an ASGI http connection scope.
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', ''),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': client[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in scope.get('headers', ()):
+            name = name.upper().replace('-', '_')
+            if name in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+                environ[name] = value
+            elif 'HTTP_' + name in environ:
+                environ['HTTP_' + name] += ',' + value
+            else:
+                environ['HTTP_' + name] = value
+        return environ
+
+    def _asgi_request(self, scope, receive, send):
+        if scope['type'] != 'http':
+            raise nfw.Error("Unsupported connection type %s" %
+                            (scope['type'],))
+
+        body = StringIO()
+        while True:
+            message = receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', ''))
+            if message.get('more_body', False) is False:
+                break
+        body.seek(0)
+
+        started = []
+
+        def start_response(status, headers):
+            started.append((status, headers))
+
+        returned = self._interface(self._environ(scope, body),
+                                   start_response)
+        try:
+            status, headers = started[0]
+            send({'type': 'http.response.start',
+                  'status': int(status.split(' ')[0]),
+                  'headers': [(h.lower(), v) for (h, v) in headers]})
+            for chunk in returned:
+                if len(chunk) > 0:
+                    send({'type': 'http.response.body',
+                          'body': chunk,
+                          'more_body': True})
+            send({'type': 'http.response.body',
+                  'body': '',
+                  'more_body': False})
+        finally:
+            if hasattr(returned, 'close'):
+                returned.close()
+
+    def _asgi(self, scope, receive, send):
+        return self.frozen.executor.submit(self._asgi_request, scope,
+                                           receive, send)
+
+    def asgi(self):
+        """Return the threaded interface.
+
+        The interface takes an ASGI http connection scope, a receive()
+        callable returning the request body messages and a send()
+        callable for the response messages. It returns immediately with
+        a Future, the request runs on one of the application *workers*
+        threads which call receive() and send() and may block in them.
+        This is not the coroutine based ASGI protocol, servers need an
+        adapter passing the messages between their event loop and the
+        worker threads.
+        """
+        return self._asgi
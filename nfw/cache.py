@@ -0,0 +1,232 @@
+# Neutrino Framework
+#
+# Copyright (c) 2016, Christiaan Frans Rademan
+# All rights reserved.
+#
+# LICENSE: (BSD3-Clause)
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENTSHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import functools
+import hashlib
+import logging
+import pickle
+import threading
+import time
+import urlparse
+
+import nfw
+
+log = logging.getLogger(__name__)
+
+
+class LocalStore(object):
+    """Cache entries kept in this process."""
+    def __init__(self, size=1024, clock=time.time):
+        self.clock = clock
+        self._lru = nfw.utils.LRU(size)
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._lru.get(key)
+
+    def set(self, key, entry, ttl):
+        self._lru.set(key, entry)
+
+    def lock(self, key, timeout):
+        now = self.clock()
+        with self._lock:
+            if self._locks.get(key, 0) > now:
+                return False
+            self._locks[key] = now + timeout
+            return True
+
+    def unlock(self, key):
+        with self._lock:
+            self._locks.pop(key, None)
+
+    def clear(self):
+        self._lru.clear()
+
+
+class RedisStore(object):
+    """Cache entries kept in Redis and shared by processes."""
+    def __init__(self, name):
+        self._name = 'nfw:cache:%s' % (name,)
+
+    def get(self, key):
+        value = nfw.redis.get('%s:%s' % (self._name, key))
+        if value is not None:
+            return pickle.loads(value)
+
+    def set(self, key, entry, ttl):
+        value = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        nfw.redis.setex('%s:%s' % (self._name, key), int(ttl) + 1, value)
+
+    def lock(self, key, timeout):
+        return bool(nfw.redis.set('%s:lock:%s' % (self._name, key), 1,
+                                  nx=True, ex=int(timeout)))
+
+    def unlock(self, key):
+        nfw.redis.delete('%s:lock:%s' % (self._name, key))
+
+    def clear(self):
+        for key in nfw.redis.scan_iter('%s:*' % (self._name,)):
+            nfw.redis.delete(key)
+
+
+class ResponseCache(object):
+    """Server side cache for GET responses and rendered fragments.
+
+    Entries are fresh for *ttl* seconds and served for another *stale*
+    seconds while a single request regenerates them. Keys are built from
+    the path, the query string when *query* is True and the values of
+    the request *headers* and *session* keys listed.
+
+    *store* is 'local' for a least recently used cache of *size* entries
+    in this process, 'redis' to share entries between processes, or any
+    object with the methods of LocalStore. *clock* returns the current
+    time in seconds, time.time() by default.
+    """
+    def __init__(self, ttl=60, stale=0, query=True, headers=(), session=(),
+                 store='local', size=1024, name='default', lock_timeout=30,
+                 clock=time.time):
+        self.ttl = ttl
+        self.stale = stale
+        self.query = query
+        self.headers = tuple(headers)
+        self.session = tuple(session)
+        self.name = name
+        self.lock_timeout = lock_timeout
+        self.clock = clock
+        if store == 'local':
+            self.store = LocalStore(size, clock)
+        elif store == 'redis':
+            self.store = RedisStore(name)
+        else:
+            self.store = store
+
+    def __call__(self, view):
+        # Decorates a view, or wraps a route added with a cache.
+        @functools.wraps(view)
+        def cached(*args, **kwargs):
+            return view(*args, **kwargs)
+        cached.response_cache = self
+        return cached
+
+    def key(self, req, *parts):
+        vary = [req.environ.get('SCRIPT_NAME', ''),
+                req.environ.get('PATH_INFO', '')]
+        if self.query is True:
+            vary.append(sorted(urlparse.parse_qsl(
+                req.environ.get('QUERY_STRING', ''), True)))
+        for header in self.headers:
+            vary.append(req.headers.get(header))
+        for key in self.session:
+            vary.append(req.session.get(key))
+        vary.extend(parts)
+        return hashlib.sha1(repr(vary)).hexdigest()
+
+    def fetch(self, key, produce):
+        """Return the cached value of *key*, calling *produce* for it
+        when missing or expired.
+
+        Only one caller regenerates an entry at a time. Others are
+        served the stale entry, or wait for the new one. Values of None
+        are not cached.
+        """
+        entry = self.store.get(key)
+        if entry is not None:
+            expires, value = entry
+            now = self.clock()
+            if expires > now:
+                return value
+            if expires + self.stale > now:
+                if not self.store.lock(key, self.lock_timeout):
+                    return value
+                return self._produce(key, produce)
+
+        deadline = self.clock() + self.lock_timeout
+        while not self.store.lock(key, self.lock_timeout):
+            if self.clock() > deadline:
+                # The regenerating request did not finish.
+                return produce()
+            time.sleep(0.05)
+            entry = self.store.get(key)
+            if entry is not None and entry[0] > self.clock():
+                return entry[1]
+        return self._produce(key, produce)
+
+    def _produce(self, key, produce):
+        # Called with the lock for key held.
+        try:
+            value = produce()
+            if value is not None:
+                self.store.set(key, (self.clock() + self.ttl, value),
+                               self.ttl + self.stale)
+            return value
+        finally:
+            self.store.unlock(key)
+
+    def fragment(self, req, name, render, *args, **kwargs):
+        """Return the cached output of render(*args, **kwargs) for the
+        fragment *name*, for example a rendered template block."""
+        return self.fetch(self.key(req, name),
+                          lambda: render(*args, **kwargs))
+
+    def respond(self, view, req, resp, kwargs):
+        """Run *view* or restore its cached response."""
+        returned = []
+
+        def produce():
+            returned.append(view(req, resp, **kwargs))
+            if (returned[0] is None and resp.status == nfw.HTTP_200 and
+                    not resp.streaming and not resp.has_file):
+                headers = [(header, resp.headers[header])
+                           for header in resp.headers
+                           if header != 'set-cookie']
+                resp.seek(0)
+                return (headers, resp.read(resp.content_length))
+
+        cached = self.fetch(self.key(req), produce)
+        if returned:
+            return returned[0]
+
+        # Headers set before the view, such as by middleware, are kept
+        # unless the cached response has them.
+        headers, body = cached
+        resp.headers.update(headers)
+        resp.status = nfw.HTTP_200
+        resp.body = body
+        return None
+
+    def clear(self):
+        self.store.clear()
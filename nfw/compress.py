@@ -0,0 +1,177 @@
+# Neutrino Framework
+#
+# Copyright (c) 2016, Christiaan Frans Rademan
+# All rights reserved.
+#
+# LICENSE: (BSD3-Clause)
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENTSHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import mimetypes
+import os
+import zlib
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import nfw
+
+log = logging.getLogger(__name__)
+
+# Content types compressed by default.
+TYPES = ('text/html',
+         'text/plain',
+         'text/css',
+         'text/xml',
+         'text/javascript',
+         'application/javascript',
+         'application/json',
+         'application/xml',
+         'image/svg+xml')
+
+# Encodings in order of preference, br only when brotli is installed.
+ENCODINGS = ('br', 'gzip', 'deflate')
+
+
+def negotiate(accept_encoding, encodings=ENCODINGS):
+    """Return the preferred encoding accepted by the client or None."""
+    accepted = {}
+    for coding in accept_encoding.split(','):
+        coding, sep, params = coding.partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, sep, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+
+    best = None
+    best_q = 0.0
+    for coding in encodings:
+        if coding == 'br' and brotli is None:
+            continue
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > best_q:
+            best = coding
+            best_q = q
+    return best
+
+
+class Compressor(object):
+    """Incremental compressor for an HTTP content coding."""
+    def __init__(self, encoding, level=6):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=level)
+        elif encoding == 'gzip':
+            self._zlib = zlib.compressobj(level, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._zlib = zlib.compressobj(level)
+        else:
+            raise nfw.Error("Unsupported content encoding %s" % (encoding,))
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+
+    def flush(self):
+        # Output everything compressed so far, the stream continues.
+        if self.encoding == 'br':
+            return self._brotli.flush()
+        return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+def compress(data, encoding, level=6):
+    compressor = Compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def stream(iterable, encoding, level=6):
+    """Generator compressing the chunks of *iterable*.
+
+    Each chunk is flushed so clients receive data as it is produced.
+    """
+    compressor = Compressor(encoding, level)
+    try:
+        for chunk in iterable:
+            if chunk:
+                data = compressor.compress(nfw.utils.if_unicode_to_utf8(chunk))
+                data += compressor.flush()
+                if data:
+                    yield data
+        yield compressor.finish()
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+def precompress(path, min_size=1024, types=TYPES):
+    """Write compressed copies of a static file next to it.
+
+    Creates path.gz, and path.br when brotli is installed, for web
+    servers serving precompressed files. Copies are only written when
+    missing or older than the file.
+    """
+    content_type = mimetypes.guess_type(path)[0]
+    if content_type not in types or os.path.getsize(path) < min_size:
+        return []
+
+    written = []
+    data = None
+    mtime = os.path.getmtime(path)
+    for (encoding, ext) in (('gzip', '.gz'), ('br', '.br')):
+        if encoding == 'br' and brotli is None:
+            continue
+        dst = path + ext
+        if os.path.exists(dst) and os.path.getmtime(dst) >= mtime:
+            continue
+        if data is None:
+            with open(path, 'rb') as handle:
+                data = handle.read()
+        if encoding == 'br':
+            compressed = compress(data, encoding, 11)
+        else:
+            compressed = compress(data, encoding, 9)
+        with open(dst, 'wb') as handle:
+            handle.write(compressed)
+        written.append(dst)
+    return written
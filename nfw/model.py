@@ -37,18 +37,42 @@ from __future__ import unicode_literals
 import logging
 from collections import OrderedDict
 from collections import Iterator
+from contextlib import contextmanager
 from copy import copy
 from datetime import datetime
+import hashlib
 import json
-import uuid
+import re
+import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
 import nfw
 from nfw.utils import ObjectName
 
 log = logging.getLogger(__name__)
 
+DATETIME_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+
+# Declared fields per model class. The field instances are shared
+# prototypes and must be copied before use, see Field._get_field.
+_fields = {}
+_keyed = {}
+
 
 def _declared_fields(cls):
+    try:
+        return _fields[cls]
+    except KeyError:
+        pass
+
     current_fields = []
     for name in dir(cls):
         prop = getattr(cls, name)
@@ -58,7 +82,68 @@ def _declared_fields(cls):
             prop._name = name
 
     current_fields.sort(key=lambda x: x[1].creation_counter)
-    return OrderedDict(current_fields)
+    fields = _fields[cls] = OrderedDict(current_fields)
+    return fields
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return str(value.strftime(DATETIME_FORMAT))
+    return value
+
+
+def _dumps(obj, use_ujson=False, **kwargs):
+    # ujson is only used on request, its output differs from json.dumps.
+    if use_ujson is True and ujson is not None and not kwargs:
+        return ujson.dumps(obj)
+    return json.dumps(obj, cls=Field._JsonEncoder, **kwargs)
+
+
+def _encode_value(field):
+    return field._data
+
+
+def _encode_text(field):
+    return _json_value(field._data)
+
+
+def _encode_field(field):
+    return field.to_python()
+
+
+def _encoder(field):
+    if isinstance(field, (Fields.Dict, Fields.List)):
+        return _encode_field
+    elif isinstance(field, (Fields.Integer, Fields.Number, Fields.Bool)):
+        return _encode_value
+    else:
+        return _encode_text
+
+
+_encoders = {}
+
+
+def _field_encoders(fields):
+    # Encoder per declared field, resolved once per field set.
+    try:
+        return _encoders[id(fields)][1]
+    except KeyError:
+        encoders = tuple([(name, _encoder(fields[name]))
+                          for name in fields])
+        _encoders[id(fields)] = (fields, encoders)
+        return encoders
+
+
+def _with_primary_key(fields, primary_key):
+    # The declared fields are shared, extend a copy once per field set.
+    key = (id(fields), primary_key)
+    try:
+        return _keyed[key][1]
+    except KeyError:
+        keyed = OrderedDict(fields)
+        keyed[primary_key] = nfw.Model.Integer(hidden=True)
+        _keyed[key] = (fields, keyed)
+        return keyed
 
 
 class FieldChecks(object):
@@ -121,6 +206,126 @@ class FieldChecks(object):
                                       value)
 
 
+_quoted = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`")
+_nested = re.compile(r"\([^()]*\)")
+
+
+def _outer(sql):
+    # Blank quoted values and parentheses keeping positions, so clauses
+    # of subqueries and words in strings are not matched.
+    def blank(match):
+        return ' ' * len(match.group(0))
+
+    sql = _quoted.sub(blank, sql)
+    while True:
+        blanked = _nested.sub(blank, sql)
+        if blanked == sql:
+            return sql.upper()
+        sql = blanked
+
+
+def _clause(sql, clause):
+    # Position of a clause of the outer query, -1 if it has none.
+    match = re.search(r"\b%s\b" % (clause.replace(' ', r'\s+'),),
+                      _outer(sql))
+    if match is None:
+        return -1
+    return match.start()
+
+
+# Generated SQL keyed by statement, table, declared fields and the
+# fields used, shared by all instances of a model.
+_statements = {}
+
+
+def _statement(key, build):
+    try:
+        return _statements[key]
+    except KeyError:
+        sql = build()
+        _statements[key] = sql
+        return sql
+
+
+class LocalCache(object):
+    """Query results for a table kept in this process."""
+    def __init__(self, table, size=1024):
+        self.table = table
+        self._lru = nfw.utils.LRU(size)
+
+    def get(self, key):
+        entry = self._lru.get(key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+
+    def set(self, key, rows, ttl):
+        self._lru.set(key, (time.time() + ttl, rows))
+
+    def clear(self):
+        self._lru.clear()
+
+
+class RedisCache(object):
+    """Query results for a table kept in Redis and shared by processes.
+
+    Each query is stored in its own key expiring after the ttl. Keys
+    include the generation of the table, clear() starts a new one and
+    the keys of older generations expire.
+    """
+    def __init__(self, table):
+        self.table = table
+        self._generation = 'nfw:query:%s' % (table,)
+
+    def _key(self, key):
+        generation = nfw.redis.get(self._generation) or 0
+        return '%s:%s:%s' % (self._generation, generation, key)
+
+    def get(self, key):
+        value = nfw.redis.get(self._key(key))
+        if value is not None:
+            return pickle.loads(value)
+
+    def set(self, key, rows, ttl):
+        value = pickle.dumps(rows, pickle.HIGHEST_PROTOCOL)
+        nfw.redis.psetex(self._key(key), max(int(ttl * 1000), 1), value)
+
+    def clear(self):
+        nfw.redis.incr(self._generation)
+
+
+# Query caches per table, cleared by writes to the table.
+_caches = {}
+
+
+def _query_cache(meta, table):
+    cache = meta.cache
+    if cache == 'local':
+        if hasattr(meta, 'cache_size'):
+            size = int(meta.cache_size)
+        else:
+            size = 1024
+        key = ('local', size)
+    elif cache == 'redis':
+        key = 'redis'
+    else:
+        # Any object with get(), set() and clear().
+        key = id(cache)
+
+    caches = _caches.setdefault(table, {})
+    if key not in caches:
+        if cache == 'local':
+            caches[key] = LocalCache(table, size)
+        elif cache == 'redis':
+            caches[key] = RedisCache(table)
+        else:
+            caches[key] = cache
+    return caches[key]
+
+
+def _cache_key(sql, values):
+    return hashlib.sha1(repr((sql, tuple(values or ())))).hexdigest()
+
+
 class Mysql(object):
     def __init__(self, db, model_name, meta, declared_fields):
         self.db = db
@@ -139,19 +344,67 @@ class Mysql(object):
         if hasattr(meta, 'db_query'):
             self.db_query = meta.db_query
         else:
-            fields = ", ".join(self.declared_fields)
-            self.db_query = "SELECT %s FROM %s" % (fields, self.db_table,)
+            self.db_query = self._select_sql()
+
+        self.cache = None
+        if getattr(meta, 'cache', None) is not None:
+            self.cache = _query_cache(meta, self.db_table)
+            if hasattr(meta, 'cache_ttl'):
+                self.cache_ttl = float(meta.cache_ttl)
+            else:
+                self.cache_ttl = 60
+            if hasattr(meta, 'cache_key'):
+                # Plain functions in Meta are unbound methods.
+                self.cache_key = getattr(meta.cache_key, '__func__',
+                                         meta.cache_key)
+            else:
+                self.cache_key = _cache_key
+
+    def _execute(self, sql, values=None):
+        # Reads go through the query cache, unless this connection has
+        # uncommitted writes that other connections cannot see.
+        if self.cache is None or self.db.in_transaction():
+            return self.db.execute(sql, values)
+
+        key = self.cache_key(sql, values)
+        rows = self.cache.get(key)
+        if rows is None:
+            rows = list(self.db.execute(sql, values))
+            self.cache.set(key, rows, self.cache_ttl)
+        return rows
+
+    def invalidate(self):
+        # Cleared again after commit, until then other connections may
+        # cache the rows committed before the write.
+        if not _caches.get(self.db_table):
+            return
+        self.clear_cache()
+        self.db.on_commit(self.clear_cache)
+
+    def clear_cache(self):
+        for cache in _caches.get(self.db_table, {}).values():
+            cache.clear()
+
+    def _select_sql(self, key=None):
+        fields = tuple(self.declared_fields)
+
+        def build():
+            sql = "SELECT %s FROM %s" % (", ".join(fields), self.db_table,)
+            if key is not None:
+                sql += " WHERE %s = %s" % (key, '%s')
+            return sql
+
+        return _statement(('SELECT', self.db_table, fields, key), build)
 
     def foreign_key(self, id=None, key=None):
-        fields = ", ".join(self.declared_fields)
-        sql = "SELECT %s FROM %s" % (fields, self.db_table,)
-        sql += " WHERE %s = %s" % (key, '%s')
-        result = self.db.execute(sql, (id,))
+        sql = self._select_sql(key)
+        result = self._execute(sql, (id,))
         if len(result) > 0:
             if len(result) == 1:
                 return result[0][self.db_primary_key]
             else:
-                raise MultipleObjectsReturned("Multiple rows for foreign key")
+                raise nfw.MultipleObjectsReturned("Multiple rows for" +
+                                                  " foreign key")
 
     def select(self, id=None, field=None, sql=None):
         if sql is None:
@@ -159,71 +412,197 @@ class Mysql(object):
 
         result = None
         if id is not None:
-            fields = ", ".join(self.declared_fields)
-            sql = "SELECT %s FROM %s" % (fields, self.db_table,)
-            sql += " WHERE %s = %s" % (self.db_primary_key, '%s')
-            result = self.db.execute(sql, (id,))
+            sql = self._select_sql(self.db_primary_key)
+            result = self._execute(sql, (id,))
             if len(result) > 0:
                 if len(result) != 1:
                     raise nfw.MultipleObjectsReturned("Multiple rows for id")
             else:
                 raise nfw.DoesNotExist("No row matching id")
         else:
-            result = self.db.execute(sql)
+            result = self._execute(sql)
+        return self._clean(result)
+
+    def select_page(self, limit, offset=0, sql=None):
+        if sql is None:
+            sql = self.db_query
+        if _clause(sql, 'ORDER BY') < 0:
+            # Without an order MySQL may repeat or skip rows between pages.
+            sql += " ORDER BY %s" % (self.db_primary_key,)
+        sql += " LIMIT %s OFFSET %s"
+        return self._clean(self._execute(sql, (limit, offset)))
+
+    def select_seek(self, key, after=None, limit=25, descending=False):
+        # Rows following *after* in order of *key*. Unless *key* is the
+        # primary key, *after* is a (value, primary key) pair and the
+        # primary key breaks ties between equal values.
+        query = self.db_query
+        pk = self.db_primary_key
+        if (after is not None and key != pk and
+                (not isinstance(after, (tuple, list)) or len(after) != 2)):
+            raise nfw.Error("Seek on '%s' expects a (value, %s) cursor" %
+                            (key, pk))
+
+        def build():
+            if descending is True:
+                op, order = '<', ' DESC'
+            else:
+                op, order = '>', ''
+            sql = query
+            for clause in ('GROUP BY', 'HAVING', 'ORDER BY', 'LIMIT'):
+                if _clause(sql, clause) >= 0:
+                    # Rows of the query are filtered and ordered as is.
+                    sql = "SELECT * FROM (%s) AS seek" % (sql,)
+                    break
+            if after is not None:
+                if key == pk:
+                    where = "%s %s %s" % (key, op, '%s')
+                else:
+                    where = "(%s %s %s OR" % (key, op, '%s') +\
+                            " (%s = %s AND %s %s %s))" % (key, '%s',
+                                                           pk, op, '%s')
+                pos = _clause(sql, 'WHERE')
+                if pos < 0:
+                    sql += " WHERE %s" % (where,)
+                else:
+                    sql = "%sWHERE (%s) AND %s" % (sql[:pos],
+                                                   sql[pos + 5:].strip(),
+                                                   where)
+            if key == pk:
+                sql += " ORDER BY %s%s" % (key, order)
+            else:
+                sql += " ORDER BY %s%s, %s%s" % (key, order, pk, order)
+            sql += " LIMIT %s"
+            return sql
+
+        sql = _statement(('SEEK', self.db_table, query, key,
+                          after is None, descending), build)
+        if after is None:
+            values = (limit,)
+        elif key == pk:
+            values = (after, limit)
+        else:
+            values = (after[0], after[0], after[1], limit)
+        return self._clean(self._execute(sql, values))
+
+    def select_in(self, key, values, chunk=1000):
+        values = list(values)
+        result = []
+        for i in range(0, len(values), chunk):
+            part = values[i:i+chunk]
+            sql = "SELECT %s FROM %s" % (", ".join(self.declared_fields),
+                                         self.db_table)
+            sql += " WHERE %s IN (%s)" % (key, ",".join(['%s'] * len(part)))
+            result.extend(self._execute(sql, tuple(part)))
         return self._clean(result)
 
+    def stream(self, sql=None, row=None):
+        if sql is None:
+            sql = self.db_query
+
+        for r in self.db.stream(sql):
+            if row is None:
+                yield self._clean_row(r)
+            else:
+                yield row([r.get(f) for f in row._fields])
+
+    def select_rows(self, row, sql=None):
+        if sql is None:
+            sql = self.db_query
+
+        fields = row._fields
+        return [row([r.get(f) for f in fields]) for r in self._execute(sql)]
+
+    def _clean_row(self, r):
+        t = {}
+        for f in r:
+            if f in self.declared_fields:
+                t[f] = r[f]
+        return t
+
     def _clean(self, result):
         clean = []
         for r in result:
-            t = {}
-            for f in r:
-                if f in self.declared_fields:
-                    t[f] = r[f]
-            clean.append(t)
+            clean.append(self._clean_row(r))
         return clean
 
+    def _fields(self, data):
+        return tuple([f for f in self.declared_fields if f in data])
+
     def insert(self, data):
-        fields = []
-        values = []
-
-        insert = []
-        sql_str_values = []
-        for declared_field in self.declared_fields:
-            if declared_field in data:
-                field = declared_field
-                fields.append(field)
-                values.append(data[field])
-                insert.append("%s" % (field))
-                sql_str_values.append("%s" % ('%s'))
-
-        insert = ",".join(insert)
-        sql_str_values = ",".join(sql_str_values)
-        new_id = uuid.uuid4()
-
-        sql = "INSERT INTO %s (%s)" % (self.db_table, insert) +\
-              " VALUES (%s)" % (sql_str_values,)
+        fields = self._fields(data)
+        values = [data[f] for f in fields]
+
+        def build():
+            return "INSERT INTO %s (%s)" % (self.db_table, ",".join(fields)) +\
+                   " VALUES (%s)" % (",".join(['%s'] * len(fields)),)
+
+        sql = _statement(('INSERT', self.db_table, fields), build)
         self.db.execute(sql, tuple(values))
+        self.invalidate()
 
         return self.db.last_row_id()
 
+    def upsert(self, data):
+        # ON DUPLICATE KEY UPDATE fires on any unique key. When a row
+        # with another id has the same value in a unique column, that row
+        # is updated and no row with the given primary key is written.
+        fields = self._fields(data)
+        if self.db_primary_key not in fields:
+            fields = fields + (self.db_primary_key,)
+        values = [data[f] for f in fields]
+
+        def build():
+            update = ["%s=VALUES(%s)" % (f, f) for f in fields
+                      if f != self.db_primary_key]
+            if len(update) == 0:
+                update = ["%s=%s" % (self.db_primary_key,
+                                     self.db_primary_key)]
+            return "INSERT INTO %s (%s)" % (self.db_table, ",".join(fields)) +\
+                   " VALUES (%s)" % (",".join(['%s'] * len(fields)),) +\
+                   " ON DUPLICATE KEY UPDATE %s" % (",".join(update),)
+
+        sql = _statement(('UPSERT', self.db_table, fields), build)
+        self.db.execute(sql, tuple(values))
+        self.invalidate()
+
+    def insert_many(self, data, max_packet=None):
+        # Rows are grouped by the fields they set, so columns left out
+        # keep their database defaults.
+        ids = [None] * len(data)
+        shapes = OrderedDict()
+        for (i, row) in enumerate(data):
+            fields = self._fields(row)
+            if fields not in shapes:
+                shapes[fields] = []
+            shapes[fields].append(i)
+
+        for fields in shapes:
+            rows = []
+            for i in shapes[fields]:
+                rows.append(tuple([data[i][f] for f in fields]))
+            new_ids = self.db.insert_many(self.db_table, fields, rows,
+                                          max_packet)
+            for (i, id) in zip(shapes[fields], new_ids):
+                ids[i] = id
+
+        self.invalidate()
+        return ids
+
     def update(self, data, id):
-        fields = []
-        values = []
-        update = []
-        sql_str_values = []
-        for declared_field in self.declared_fields:
-            if declared_field in data:
-                field = declared_field
-                fields.append(field)
-                values.append(data[field])
-                update.append("%s=%s" % (field, "%s"))
+        fields = self._fields(data)
+        values = [data[f] for f in fields]
         values.append(id)
 
-        update = ",".join(update)
+        def build():
+            update = ",".join(["%s=%s" % (f, '%s') for f in fields])
+            return "UPDATE %s SET %s" % (self.db_table, update) +\
+                   " WHERE %s = %s" % (self.db_primary_key, '%s')
 
-        sql = "UPDATE %s SET %s" % (self.db_table, update) +\
-              " WHERE %s = %s" % (self.db_primary_key, '%s')
+        sql = _statement(('UPDATE', self.db_table, fields,
+                          self.db_primary_key), build)
         self.db.execute(sql, tuple(values))
+        self.invalidate()
 
     def commit(self):
         self.db.commit()
@@ -232,16 +611,121 @@ class Mysql(object):
         self.db.rollback()
 
     def delete(self, id):
-        sql = "DELETE FROM %s WHERE %s = %s" % (self.db_table,
-                                                self.db_primary_key,
-                                                '%s')
+        def build():
+            return "DELETE FROM %s WHERE %s = %s" % (self.db_table,
+                                                     self.db_primary_key,
+                                                     '%s')
+
+        sql = _statement(('DELETE', self.db_table, self.db_primary_key),
+                         build)
         self.db.execute(sql, (id,))
+        self.invalidate()
+
+
+class _Value(object):
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def value(self):
+        return self._data
+
+    def to_python(self):
+        return _json_value(self._data)
+
+    def __str__(self):
+        return str(self._data)
+
+    def __repr__(self):
+        return repr(self._data)
+
+
+class Row(object):
+    """Read only row holding its values in a list.
+
+    Field names are shared by all rows of a model through a subclass
+    created by row_class(). row['field'] returns an object with value()
+    like the fields of a model row.
+    """
+    __slots__ = ('_values',)
+    _fields = ()
+    _index = {}
+
+    def __init__(self, values):
+        self._values = values
+
+    def __getitem__(self, key):
+        return _Value(self._values[self._index[key]])
+
+    def __setitem__(self, key, value):
+        raise nfw.Error("compact rows are read-only")
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return repr(self.value())
+
+    def get(self, key, default=None):
+        if key in self._index:
+            return self[key]
+        return default
+
+    def value(self):
+        return OrderedDict(zip(self._fields, self._values))
+
+    def to_python(self):
+        return OrderedDict(zip(self._fields,
+                               [_json_value(v) for v in self._values]))
+
+    def dump_json(self, **kwargs):
+        return _dumps(self.to_python(), **kwargs)
+
+
+_rows = {}
+
+
+def row_class(fields):
+    fields = tuple(fields)
+    try:
+        return _rows[fields]
+    except KeyError:
+        index = dict([(f, i) for (i, f) in enumerate(fields)])
+        cls = type(str('Row'), (Row,), {'__slots__': (),
+                                        '_fields': fields,
+                                        '_index': index})
+        _rows[fields] = cls
+        return cls
+
+
+class Page(object):
+    """Rows of a page and the cursor for the next page.
+
+    *next* is None on the last page.
+    """
+    def __init__(self, rows, next=None, number=None):
+        self.rows = rows
+        self.next = next
+        self.number = number
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows._data)
 
 
 class Field(ObjectName):
     def __init__(self, value=None, id=None, db=None, **kwargs):
         self.creation_counter = nfw.creation_counter()
-        self._declared_fields = _declared_fields(self)
+        self._declared_fields = _declared_fields(self.__class__)
 
         self._id = id
         self._name = None
@@ -253,6 +737,8 @@ class Field(ObjectName):
         self._parent = None
         self._parent_key = None
         self._parent_key_value = None
+        # True when the row is known to exist in the database.
+        self._persisted = False
 
         if hasattr(self, '_init'):
             self._init()
@@ -297,18 +783,17 @@ class Field(ObjectName):
 
     def _init_db(self):
         if self._dbo is not None:
-            self._db = Mysql(self._dbo,
-                             self._table,
-                             self.Meta,
-                             self._declared_fields)
             if hasattr(self.Meta, 'db_primary_key'):
                 self._db_primary_key = self.Meta.db_primary_key
-                if self._db_primary_key not in self._declared_fields:
-                    self._declared_fields[self._db_primary_key] = nfw.Model.Integer(hidden=True)
             else:
                 self._db_primary_key = 'id'
-                if self._db_primary_key not in self._declared_fields:
-                    self._declared_fields[self._db_primary_key] = nfw.Model.Integer(hidden=True)
+            if self._db_primary_key not in self._declared_fields:
+                self._declared_fields = _with_primary_key(
+                    self._declared_fields, self._db_primary_key)
+            self._db = Mysql(self._dbo,
+                             self._table,
+                             self.Meta,
+                             self._declared_fields)
 
     def _val(self, value):
         if hasattr(self, '_validate'):
@@ -318,6 +803,8 @@ class Field(ObjectName):
     def _get_field(self, field):
         if field in self._declared_fields:
             field = copy(self._declared_fields[field])
+            if hasattr(field, '_detach'):
+                field._detach()
             return field
         else:
             raise nfw.FieldDoesNotExist(field)
@@ -336,33 +823,22 @@ class Field(ObjectName):
 
     class _JsonEncoder(json.JSONEncoder):
         def default(self, o):
-            if isinstance(o.value(), datetime):
-                return str(o.value().strftime("%Y/%m/%d %H:%M:%S"))
+            if isinstance(o, datetime):
+                return str(o.strftime(DATETIME_FORMAT))
+            elif isinstance(o.value(), datetime):
+                return str(o.value().strftime(DATETIME_FORMAT))
             else:
                 return o.value()
 
-    class _JsonDecoder(json.JSONDecoder):
-        def __init__(self, list_type=list,  **kwargs):
-            json.JSONDecoder.__init__(self, **kwargs)
-            # Use the custom JSONArray
-            self.parse_array = self.JSONArray
-            # Use the python implemenation of the scanner
-            self.scan_once = json.scanner.py_make_scanner(self)
-            self.list_type = list_type
-
-        def JSONArray(self, s_and_end, scan_once, **kwargs):
-            values, end = json.decoder.JSONArray(s_and_end,
-                                                 scan_once,
-                                                 **kwargs)
-            return self.list_type(values), end
+    def to_python(self):
+        """Return the value as plain lists, dicts and values for JSON."""
+        return _json_value(self._data)
 
     def dump_json(self, **kwargs):
-        return json.dumps(self,
-                          cls=self._JsonEncoder,
-                          **kwargs)
+        return _dumps(self.to_python(), **kwargs)
 
     def load_json(self, fp, **kwargs):
-        json.loads(fp, cls=self._JsonDecoder, list_type=self)
+        self(json.loads(fp, **kwargs))
 
     def commit(self):
         if hasattr(self, '_db'):
@@ -377,8 +853,17 @@ class Fields(object):
     class List(Field):
         def _init(self):
             self._data = []
+            self._deferred = 0
+            self._batched = []
+
+        def _detach(self):
+            # Copies of a declared field must not share its containers.
+            self._data = list(self._data)
+            self._batched = []
 
         def __setitem__(self, key, value):
+            if isinstance(self._data[key], Row):
+                raise nfw.Error("compact rows are read-only")
             self._data[key]._set(value)
 
         def __getitem__(self, key):
@@ -392,7 +877,7 @@ class Fields(object):
         def __iter__(self):
             return iter(self._data)
 
-        def append(self, v, _load=False):
+        def _row(self, v, _load=False, related=None):
             new = Fields.Dict()
             setattr(new, '_declared_fields', self._declared_fields)
             if hasattr(self, 'Meta'):
@@ -401,23 +886,269 @@ class Fields(object):
             if self._dbo is not None:
                 new._dbo = self._dbo
                 new._init_db()
+            if related is not None:
+                new._related = related
             new._set(v, _load)
-            self._data.append(new)
+            # Only used while loading, later changes query the relation.
+            new._related = {}
+            return new
+
+        def _eager(self, result, eager):
+            # Load the rows of nested models referenced by the result with
+            # one query per relation, keyed by field and foreign key value.
+            related = {}
+            if eager is True:
+                eager = list(self._declared_fields)
+            for field in eager:
+                model = self._declared_fields.get(field)
+                if (not isinstance(model, Fields.Dict) or
+                        not hasattr(model, '_db') or
+                        model.foreign_key is None):
+                    continue
+                values = set()
+                for row in result:
+                    if row.get(field) is not None:
+                        values.add(row[field])
+                rows = {}
+                if len(values) > 0:
+                    for row in model._db.select_in(model.foreign_key,
+                                                   sorted(values)):
+                        key = row[model.foreign_key]
+                        if key in rows:
+                            raise nfw.MultipleObjectsReturned("Multiple" +
+                                                              " rows for" +
+                                                              " foreign key")
+                        rows[key] = row
+                related[field] = rows
+            return related
 
-        def query(self, sql=None):
+        def append(self, v, _load=False):
+            if self._deferred > 0 and _load is False:
+                new = self._row(None)
+                new._deferred += 1
+                self._batched.append(new)
+                new._set(v)
+                self._data.append(new)
+            else:
+                self._data.append(self._row(v, _load))
+
+        @contextmanager
+        def batch(self):
+            """Write the changes to each row made within the block once.
+
+            Rows changed or appended inside the block are written in list
+            order on exit, one statement per row.
+            """
+            if self._deferred == 0:
+                for row in self._data:
+                    if isinstance(row, Row):
+                        raise nfw.Error("compact rows are read-only")
+                self._batched = list(self._data)
+                for row in self._batched:
+                    row._deferred += 1
+            self._deferred += 1
+            try:
+                yield self
+            except:
+                self._deferred -= 1
+                if self._deferred == 0:
+                    self._release(False)
+                raise
+            self._deferred -= 1
+            if self._deferred == 0:
+                self._release(True)
+
+        def _release(self, flush):
+            for row in self._batched:
+                row._deferred -= 1
+            self._batched = []
+            for row in self._data:
+                if isinstance(row, Row):
+                    continue
+                if not row._is_deferred():
+                    if flush is True:
+                        row.flush()
+                    else:
+                        row.discard()
+
+        def extend(self, values, max_packet=None):
+            """Append and insert rows with multi row INSERT statements.
+
+            Rows that create nested models are inserted one at a time with
+            append(), after the rows preceding them so the order is kept.
+            Returns the id of each row, None for rows not inserted.
+            """
+            ids = []
+            pending = []
+            for v in values:
+                if not isinstance(v, dict):
+                    raise nfw.ValidationError("'%s' Expecting dictionary" %
+                                              (str(self._objectname()),))
+                nested = False
+                for k in v:
+                    if isinstance(v[k], dict):
+                        nested = True
+                if nested is True:
+                    ids.extend(self._insert_rows(pending, max_packet))
+                    pending = []
+                    self.append(v)
+                    row = self._data[-1]
+                    pk = getattr(row, '_db_primary_key', None)
+                    if pk in row._data:
+                        ids.append(row._data[pk].value())
+                    else:
+                        ids.append(None)
+                else:
+                    pending.append(v)
+            ids.extend(self._insert_rows(pending, max_packet))
+            return ids
+
+        def _insert_rows(self, values, max_packet=None):
+            rows = []
+            updates = []
+            for v in values:
+                row = self._row(v, True)
+                update = {}
+                for k in v:
+                    if isinstance(row._data[k], Fields.Dict):
+                        update[k] = v[k]
+                    else:
+                        update[k] = row._data[k].value()
+                rows.append(row)
+                updates.append(update)
+
+            ids = [None] * len(rows)
+            if hasattr(self, '_db') and len(rows) > 0:
+                ids = self._db.insert_many(updates, max_packet)
+                for (row, id) in zip(rows, ids):
+                    pk = self._db_primary_key
+                    row._data[pk] = self._get_field(pk)
+                    row._data[pk]._set(id)
+                    row._id = id
+                    row._persisted = True
+            self._data.extend(rows)
+            return ids
+
+        def query(self, sql=None, eager=None, compact=False):
+            """Load rows from the database.
+
+            *eager* is True or a list of nested model fields for which
+            related rows are loaded with one query per field, instead of
+            queries per row.
+
+            With *compact* rows are loaded as read only Row objects which
+            share field names and only hold a list of values. Nested
+            models are not loaded, their fields hold the key value.
+            """
             if hasattr(self, '_db'):
-                self._data = []
-                result = self._db.select(sql=sql)
-                for row in result:
-                    self.append(row, True)
+                if compact is True:
+                    self._data = self._db.select_rows(self._row_class(), sql)
+                else:
+                    self._load_result(self._db.select(sql=sql), eager)
+
+        def _row_class(self):
+            return row_class(self._declared_fields)
+
+        def _load_result(self, result, eager=None):
+            self._data = []
+            related = None
+            if eager:
+                related = self._eager(result, eager)
+            for row in result:
+                self._data.append(self._row(row, True, related))
+
+        def page(self, number=1, size=25, sql=None, eager=None):
+            """Load a page of rows using LIMIT and OFFSET.
+
+            Returns a Page with the number of the next page as cursor.
+            """
+            if hasattr(self, '_db'):
+                result = self._db.select_page(size + 1, (number - 1) * size,
+                                              sql)
+                self._load_result(result[:size], eager)
+                if len(result) > size:
+                    return Page(self, number + 1, number)
+                return Page(self, None, number)
+
+        def seek(self, after=None, size=25, key=None, descending=False,
+                 eager=None):
+            """Load the rows following a cursor in order of *key*.
+
+            The query seeks on an index instead of skipping rows, so deep
+            pages cost the same as the first. *key* defaults to the
+            primary key and should be an indexed column. Returns a Page
+            with the cursor for the next page, pass it as *after*.
+            """
+            if hasattr(self, '_db'):
+                pk = self._db_primary_key
+                if key is None:
+                    key = pk
+                result = self._db.select_seek(key, after, size + 1,
+                                              descending)
+                self._load_result(result[:size], eager)
+                if len(result) > size:
+                    last = result[size - 1]
+                    if key == pk:
+                        return Page(self, last[key])
+                    return Page(self, (last[key], last[pk]))
+                return Page(self, None)
+
+        def stream(self, sql=None, compact=False):
+            # Rows are yielded one at a time from a server side cursor
+            # and not kept in the list. Nested models are not loaded,
+            # their fields hold the key value as with compact rows.
+            if hasattr(self, '_db'):
+                if compact is True:
+                    for row in self._db.stream(sql, self._row_class()):
+                        yield row
+                else:
+                    for row in self._db.stream(sql=sql):
+                        yield self._row(row, True, False)
 
         def __call__(self, v):
-            for i in v:
-                self.append(i)
+            self.extend(v)
+
+        def to_python(self):
+            return [row.to_python() for row in self._data]
+
+        def iter_json(self, rows=None, batch=100, **kwargs):
+            """Yield the rows as a JSON array, batch rows per chunk.
+
+            rows defaults to the rows in the list and may be any iterable
+            of rows such as stream().
+            """
+            separator = kwargs.get('separators', (', ', ': '))[0]
+            if rows is None:
+                rows = self._data
+            yield '['
+            chunk = []
+            prefix = ''
+            for row in rows:
+                chunk.append(_dumps(row.to_python(), **kwargs))
+                if len(chunk) == batch:
+                    yield prefix + separator.join(chunk)
+                    prefix = separator
+                    chunk = []
+            if len(chunk) > 0:
+                yield prefix + separator.join(chunk)
+            yield ']'
+
+        def write_json(self, fp, rows=None, batch=100, **kwargs):
+            for chunk in self.iter_json(rows, batch, **kwargs):
+                fp.write(chunk)
 
     class Dict(Field):
         def _init(self):
             self._data = {}
+            self._deferred = 0
+            self._dirty = {}
+            self._related = {}
+
+        def _detach(self):
+            # Copies of a declared field must not share its containers.
+            self._data = dict(self._data)
+            self._dirty = {}
+            self._related = {}
 
         def _set(self, v, _load=False):
             if v is not None:
@@ -425,7 +1156,8 @@ class Fields(object):
                     updates = {}
                     for i in v:
                         val = v[i]
-                        if i not in self._data:
+                        if (i not in self._data or
+                                isinstance(self._data[i], _Value)):
                             self._data[i] = self._get_field(i)
                             if isinstance(self._data[i], Fields.List):
                                 raise nfw.ValidationError("Property is a" +
@@ -444,40 +1176,128 @@ class Fields(object):
                                 fk = self._data[i].foreign_key
                                 if fk in val:
                                     updates[i] = val[fk]
+                            elif _load is True and self._related is False:
+                                # Streamed rows keep the key, the relation
+                                # is not queried while the cursor is open.
+                                self._data[i] = _Value(val)
+                                updates[i] = val
                             else:
                                 self._data[i]._parent_key_value = val
-                                self._data[i].query()
+                                if _load is True and i in self._related:
+                                    self._data[i]._populate(self._related[i].get(val))
+                                else:
+                                    self._data[i].query()
                                 updates[i] = val
                         else:
                             updates[i] = val
                             if hasattr(self._data[i],'_validate'):
                                 val = self._data[i]._validate(val)
                             self._data[i]._set(val)
-                    if hasattr(self, '_db') and _load is False:
-                        if len(updates) > 0:
+                    if hasattr(self, '_db'):
+                        if _load is True:
                             if self._db_primary_key in self._data:
-                                id = self._data[self._db_primary_key].value()
-                                if len(self._db.select(id=id)) > 0:
-                                        self._db.update(updates, id)
-                                else:
-                                    id = self._db.insert(updates)
-                                    updates[self._db_primary_key] = id
-                                    if self.foreign_key in updates:
-                                        self._parent_key_value = updates[self.foreign_key]
-                                        self._parent._set({self._parent_key: self._parent_key_value})
-                                        self._data[self._db_primary_key] = id
+                                self._persisted = True
+                        elif len(updates) > 0:
+                            if self._is_deferred():
+                                self._dirty.update(updates)
                             else:
-                                self._data[self._db_primary_key] = self._get_field(self._db_primary_key)
-                                id = self._db.insert(updates)
-                                updates[self._db_primary_key] = id
-                                self._data[self._db_primary_key]._set(id)
-                                self._id = id
-                                if self.foreign_key in updates:
-                                    self._parent_key_value = updates[self.foreign_key]
-                                    self._parent._set({self._parent_key: self._parent_key_value})
+                                self._save(updates)
                 else:
                     raise nfw.ValidationError("'%s' Expecting dictionary" % (str(self._objectname()),))
 
+        def _save(self, updates):
+            if self._db_primary_key in self._data:
+                id = self._data[self._db_primary_key].value()
+                if self._persisted is True:
+                    self._db.update(updates, id)
+                    return
+                # Primary key provided but row not loaded, the row is
+                # updated if it exists or inserted otherwise.
+                data = dict(updates)
+                data[self._db_primary_key] = id
+                self._db.upsert(data)
+                self._persisted = True
+                updates[self._db_primary_key] = id
+            else:
+                self._data[self._db_primary_key] = self._get_field(self._db_primary_key)
+                id = self._db.insert(updates)
+                updates[self._db_primary_key] = id
+                self._data[self._db_primary_key]._set(id)
+                self._id = id
+                self._persisted = True
+            if self.foreign_key in updates:
+                self._parent_key_value = updates[self.foreign_key]
+                self._parent._link(self._parent_key, self._parent_key_value)
+
+        def _link(self, key, value):
+            # Store the foreign key of a nested model after it was saved,
+            # the nested model already holds its data.
+            if self._is_deferred():
+                self._dirty[key] = value
+            else:
+                self._save({key: value})
+
+        def _is_deferred(self):
+            if self._deferred > 0:
+                return True
+            if isinstance(self._parent, Fields.Dict):
+                return self._parent._is_deferred()
+            return False
+
+        def is_dirty(self):
+            if len(self._dirty) > 0:
+                return True
+            for key in self._data:
+                if (isinstance(self._data[key], Fields.Dict) and
+                        self._data[key].is_dirty()):
+                    return True
+            return False
+
+        def flush(self):
+            """Write pending changes of the row and its nested models.
+
+            Nested models are written first so their keys are included in
+            the single INSERT or UPDATE of the row.
+            """
+            self._deferred += 1
+            try:
+                for key in list(self._data):
+                    field = self._data[key]
+                    if isinstance(field, Fields.Dict) and field.is_dirty():
+                        field.flush()
+            finally:
+                self._deferred -= 1
+            if len(self._dirty) > 0:
+                dirty = self._dirty
+                self._dirty = {}
+                self._save(dirty)
+
+        def discard(self):
+            self._dirty = {}
+            for key in self._data:
+                if isinstance(self._data[key], Fields.Dict):
+                    self._data[key].discard()
+
+        @contextmanager
+        def batch(self):
+            """Write all changes made within the block once on exit.
+
+            with row.batch():
+                row['firstname'] = 'John'
+                row['lastname'] = 'Doe'
+            """
+            self._deferred += 1
+            try:
+                yield self
+            except:
+                self._deferred -= 1
+                if not self._is_deferred():
+                    self.discard()
+                raise
+            self._deferred -= 1
+            if not self._is_deferred():
+                self.flush()
+
         def __setitem__(self, key, value):
             self._set({key: value})
 
@@ -512,6 +1332,7 @@ class Fields(object):
                 if self._parent_key in self._parent:
                     self._parent[self._parent_key] = None
             self._data = {}
+            self._persisted = False
 
         def __iter__(self):
             results = OrderedDict()
@@ -527,17 +1348,34 @@ class Fields(object):
                     results[key] = self._data[key]
             return results
 
+        def to_python(self):
+            data = self._data
+            results = OrderedDict()
+            for key, encode in _field_encoders(self._declared_fields):
+                if key in data:
+                    results[key] = encode(data[key])
+            return results
+
         def query(self, sql=None):
             if hasattr(self, '_db'):
                 if self.foreign_key is not None:
                     if self._parent_key_value is not None:
                         self._id = self._db.foreign_key(self._parent_key_value, self.foreign_key)
                 self._data = {}
+                self._persisted = False
                 if self._id is not None:
                     result = self._db.select(id=self._id, sql=sql)
                     if len(result) == 1:
                         self._set(result[0], True)
 
+        def _populate(self, row):
+            # Populate from a row already fetched from the database.
+            self._data = {}
+            self._persisted = False
+            if row is not None:
+                self._id = row.get(self._db_primary_key)
+                self._set(row, True)
+
         def get(self, key, default=None):
             try:
                 return self._data[key]
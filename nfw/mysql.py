@@ -34,23 +34,209 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import itertools
 import logging
 import thread
-from Queue import Queue
+import threading
+import time
 import MySQLdb
 import MySQLdb.cursors
 import nfw
 
 log = logging.getLogger(__name__)
 
+# Client errors for a connection that could not be made or was lost.
+CONNECTION_LOST = (2002, 2003, 2006, 2013)
+
+
+class Pool(object):
+    """Bounded connection pool for a named database.
+
+    Connections are created on demand up to *max_size*. When all of them
+    are in use, get() blocks for up to *timeout* seconds. Idle connections
+    above *min_size* are closed after *idle_timeout* seconds and any
+    connection older than *max_lifetime* seconds is replaced. Only
+    connections idle for longer than *ping_interval* seconds are pinged
+    on checkout.
+    """
+    def __init__(self, name, min_size=0, max_size=10, timeout=10,
+                 idle_timeout=300, max_lifetime=3600, ping_interval=30,
+                 host=None):
+        self.name = name
+        self.host = host
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+
+        self._idle = []
+        self._created = {}
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+        self.created = 0
+        self.destroyed = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def configure(self, **kwargs):
+        with self._lock:
+            for k in kwargs:
+                if kwargs[k] is not None:
+                    setattr(self, k, kwargs[k])
+
+    def _expired(self, conn, now):
+        return now - self._created[conn] > self.max_lifetime
+
+    def _discard(self, conn):
+        # Called with lock held.
+        del self._created[conn]
+        self.destroyed += 1
+
+    def _evict(self, now):
+        # Called with lock held, returns connections to be closed.
+        evicted = []
+        for (conn, last_used) in list(self._idle):
+            if (self._expired(conn, now) or
+                    (now - last_used > self.idle_timeout and
+                     self._in_use + len(self._idle) > self.min_size)):
+                self._idle.remove((conn, last_used))
+                self._discard(conn)
+                evicted.append(conn)
+        return evicted
+
+    def _close(self, connections):
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def get(self):
+        started = time.time()
+        deadline = started + self.timeout
+        waited = False
+        while True:
+            conn = None
+            with self._lock:
+                while True:
+                    now = time.time()
+                    evicted = self._evict(now)
+                    if len(self._idle) > 0:
+                        conn, last_used = self._idle.pop()
+                        self._in_use += 1
+                        break
+                    elif self._in_use < self.max_size:
+                        # Reserve a slot, the connection is opened below
+                        # without holding the lock.
+                        self._in_use += 1
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        if waited is True:
+                            self.wait_time += now - started
+                        self._close(evicted)
+                        raise nfw.HTTPServiceUnavailable(
+                            'Database Unavailable',
+                            'Timeout waiting for database connection' +
+                            ' (%s)' % (self.name,))
+                    if waited is False:
+                        waited = True
+                        self.waits += 1
+                    self._available.wait(remaining)
+                if waited is True:
+                    self.wait_time += time.time() - started
+                    waited = None
+            self._close(evicted)
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._in_use -= 1
+                        self._available.notify()
+                    raise
+                with self._lock:
+                    self._created[conn] = time.time()
+                    self.created += 1
+                return conn
+
+            if now - last_used > self.ping_interval:
+                try:
+                    conn.ping(True)
+                except Exception as e:
+                    log.error("Database connection failed health check" +
+                              " (%s) %s" % (self.name, e))
+                    with self._lock:
+                        self._in_use -= 1
+                        self._discard(conn)
+                        self._available.notify()
+                    self._close([conn])
+                    continue
+            return conn
+
+    def put(self, conn):
+        with self._lock:
+            self._in_use -= 1
+            now = time.time()
+            if conn in self._created and not self._expired(conn, now):
+                self._idle.append((conn, now))
+                conn = None
+            elif conn in self._created:
+                self._discard(conn)
+            self._available.notify()
+        if conn is not None:
+            self._close([conn])
+
+    def discard(self, conn):
+        # Returns a connection that failed, it is closed and not reused.
+        with self._lock:
+            self._in_use -= 1
+            if conn in self._created:
+                self._discard(conn)
+            self._available.notify()
+        self._close([conn])
+
+    def _connect(self):
+        credentials = Mysql._credentials[self.name]
+        if self.host is not None:
+            host = self.host
+        else:
+            host = credentials.get('host', '127.0.0.1')
+        return connect(host,
+                       credentials.get('username', ''),
+                       credentials.get('password', ''),
+                       credentials.get('database', ''))
+
+    def stats(self):
+        with self._lock:
+            return {'in_use': self._in_use,
+                    'idle': len(self._idle),
+                    'created': self.created,
+                    'destroyed': self.destroyed,
+                    'waits': self.waits,
+                    'wait_time': self.wait_time}
+
 
 class Mysql(object):
     _pool = {}
     _credentials = {}
     _thread = {}
+    # Database names pinned to the primary per thread after a write.
+    _pinned = {}
+    # Replica pools skipped until the time they may be retried.
+    _down = {}
+    _next = itertools.count()
 
     def __init__(self, name=None, host=None, username=None,
-                 password=None, database=None):
+                 password=None, database=None, pool_min=None,
+                 pool_max=None, pool_timeout=None, pool_idle_timeout=None,
+                 pool_max_lifetime=None, pool_ping_interval=None,
+                 replicas=None, replica_retry=None):
 
         self.thread_id = thread.get_ident()
 
@@ -63,11 +249,26 @@ class Mysql(object):
         self.username = username
         self.password = password
         self.database = database
+        self.replicas = replicas
+        self.replica_retry = replica_retry
+        self._last = None
         self.initialize()
+        if (pool_min is not None or pool_max is not None or
+                pool_timeout is not None or pool_idle_timeout is not None or
+                pool_max_lifetime is not None or
+                pool_ping_interval is not None):
+            for key in [self.name] + self._replica_keys():
+                self._pool[key].configure(
+                    min_size=_int(pool_min),
+                    max_size=_int(pool_max),
+                    timeout=_float(pool_timeout),
+                    idle_timeout=_float(pool_idle_timeout),
+                    max_lifetime=_float(pool_max_lifetime),
+                    ping_interval=_float(pool_ping_interval))
 
     def initialize(self):
         if self.name not in self._pool:
-            self._pool[self.name] = Queue(maxsize=0)
+            self._pool[self.name] = Pool(self.name)
 
         if self.name not in self._credentials:
             self._credentials[self.name] = {}
@@ -79,83 +280,298 @@ class Mysql(object):
             self._credentials[self.name]['password'] = self.password
         if self.database is not None:
             self._credentials[self.name]['database'] = self.database
+        if self.replicas is not None:
+            if isinstance(self.replicas, basestring):
+                self.replicas = self.replicas.split(',')
+            hosts = [h.strip() for h in self.replicas if h.strip() != '']
+            self._credentials[self.name]['replicas'] = hosts
+            for host in hosts:
+                key = '%s@%s' % (self.name, host)
+                if key not in self._pool:
+                    self._pool[key] = Pool(self.name, host=host)
+        if self.replica_retry is not None:
+            self._credentials[self.name]['replica_retry'] = float(
+                self.replica_retry)
 
         self.host = self._credentials[self.name].get('host','127.0.0.1')
         self.username = self._credentials[self.name].get('username','')
         self.password = self._credentials[self.name].get('password','')
         self.database = self._credentials[self.name].get('database','')
+        self.replicas = self._credentials[self.name].get('replicas', [])
+
+    def _acquire(self, key=None):
+        # Connections are only checked out of the pool on first use
+        # within a thread, requests without queries never touch the pool.
+        if key is None:
+            key = self.name
+        if self.thread_id not in self._thread:
+            self._thread[self.thread_id] = {}
+        if key not in self._thread[self.thread_id]:
+            conn = self._pool[key].get()
+            cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+            self._thread[self.thread_id][key] = {}
+            self._thread[self.thread_id][key]['db'] = conn
+            self._thread[self.thread_id][key]['cursor'] = cursor
+            self._thread[self.thread_id][key]['pool'] = key
+            self._thread[self.thread_id][key]['uncommited'] = False
+            self._thread[self.thread_id][key]['executed'] = False
+            self._thread[self.thread_id][key]['on_commit'] = set()
+        return self._thread[self.thread_id][key]
+
+    def _acquired(self, key=None):
+        if key is None:
+            key = self.name
+        return (self.thread_id in self._thread and
+                key in self._thread[self.thread_id])
+
+    def _replica_keys(self):
+        return ['%s@%s' % (self.name, h) for h in self.replicas]
+
+    def _replica(self):
+        # Connection for reads on a healthy replica. None when there are
+        # no replicas, after a write or when no replica is available.
+        if len(self.replicas) == 0 or self.pinned():
+            return None
+
+        keys = self._replica_keys()
+        for key in keys:
+            # Reads within a request stay on the same replica.
+            if self._acquired(key):
+                return self._thread[self.thread_id][key]
+
+        start = next(self._next)
+        now = time.time()
+        for i in range(len(keys)):
+            key = keys[(start + i) % len(keys)]
+            if self._down.get(key, 0) > now:
+                continue
+            try:
+                return self._acquire(key)
+            except nfw.HTTPServiceUnavailable:
+                # Replica busy, reads fall back to the next one.
+                continue
+            except Exception as e:
+                self._failed(key, e)
+        return None
+
+    def _failed(self, key, e):
+        retry = self._credentials[self.name].get('replica_retry', 30)
+        log.error("Database replica unavailable (%s) %s" % (key, e) +
+                  " retry in %s seconds" % (retry,))
+        self._down[key] = time.time() + retry
+
+    def _lost(self, conn, e):
+        key = conn['pool']
+        del self._thread[self.thread_id][key]
+        self._pool[key].discard(conn['db'])
+        self._failed(key, e)
+
+    def pin(self):
+        """Send all queries to the primary until the request ends."""
+        if self.thread_id not in self._pinned:
+            self._pinned[self.thread_id] = set()
+        self._pinned[self.thread_id].add(self.name)
+
+    def pinned(self):
+        return (self.thread_id in self._pinned and
+                self.name in self._pinned[self.thread_id])
 
-        if (self.thread_id in self._thread and
-                self.name in self._thread[self.thread_id]):
-            pass
-        else:
-            if self.thread_id not in self._thread:
-                self._thread[self.thread_id] = {}
-            if self._pool[self.name].empty():
-                conn = connect(self.host,
-                               self.username,
-                               self.password,
-                               self.database)
-                cursor = conn.cursor(MySQLdb.cursors.DictCursor)
-            else:
-                conn = self._pool[self.name].get(True)
-                conn.ping(True)
-                cursor = conn.cursor(MySQLdb.cursors.DictCursor)
-            self._thread[self.thread_id][self.name] = {}
-            self._thread[self.thread_id][self.name]['db'] = conn
-            self._thread[self.thread_id][self.name]['cursor'] = cursor
-            self._thread[self.thread_id][self.name]['uncommited'] = False
+    @staticmethod
+    def stats(name='default'):
+        if name in nfw.Mysql._pool:
+            return nfw.Mysql._pool[name].stats()
 
     @staticmethod
     def close_all():
         thread_id = thread.get_ident()
         if thread_id in nfw.Mysql._thread:
             for o in nfw.Mysql._thread[thread_id]:
-                db = nfw.Mysql._thread[thread_id][o]['db']
-                cursor = nfw.Mysql._thread[thread_id][o]['cursor']
-                uncommited = nfw.Mysql._thread[thread_id][o]['uncommited']
-                if uncommited is True:
-                    rollback(db)
-                # Autocommit neccessary for next request to start new transactions.
-                # If not applied select queries will return cached results
-                commit(db)
-                nfw.Mysql._pool[o].put_nowait(db)
+                conn = nfw.Mysql._thread[thread_id][o]
+                # Ending the transaction is neccessary for the next request
+                # to start a new one. If not applied select queries will
+                # return cached results.
+                end(conn)
+                nfw.Mysql._pool[o].put(conn['db'])
             del nfw.Mysql._thread[thread_id]
+        nfw.Mysql._pinned.pop(thread_id, None)
 
     def close(self):
-        if (self.thread_id in self._thread and
-                self.name in self._thread[self.thread_id]):
-            db = self._thread[self.thread_id][self.name]['db']
-            cursor = self._thread[self.thread_id][self.name]['cursor']
-            uncommited = self._thread[self.thread_id][self.name]['uncommited']
-            if uncommited is True:
-                rollback(db)
-            self._pool[self.name].put_nowait(db)
-            del self._thread[self.thread_id][self.name]
+        for key in [self.name] + self._replica_keys():
+            if self._acquired(key):
+                conn = self._thread[self.thread_id][key]
+                end(conn)
+                self._pool[key].put(conn['db'])
+                del self._thread[self.thread_id][key]
+        if self.pinned():
+            self._pinned[self.thread_id].discard(self.name)
+
+    def in_transaction(self):
+        # True when writes on this thread's connection are not committed.
+        if self._acquired():
+            return self._thread[self.thread_id][self.name]['uncommited']
+        return False
 
     def last_row_id(self):
-        cursor = self._thread[self.thread_id][self.name]['cursor']
-        return cursor.lastrowid
+        if self._acquired():
+            cursor = self._thread[self.thread_id][self.name]['cursor']
+            return cursor.lastrowid
 
     def last_row_count(self):
-        cursor = self._thread[self.thread_id][self.name]['cursor']
-        return cursor.rowcount
+        if self._last is not None:
+            return self._last['cursor'].rowcount
+        if self._acquired():
+            cursor = self._thread[self.thread_id][self.name]['cursor']
+            return cursor.rowcount
+
+    def _primary(self, query):
+        # Writes and locking reads pin the primary for the request, as
+        # replicas may not have the changes yet.
+        if len(self.replicas) == 0:
+            return True
+        if is_write(query) or is_locking(query):
+            self.pin()
+            return True
+        return False
 
     def execute(self, query=None, params=None):
-        cursor = self._thread[self.thread_id][self.name]['cursor']
-        result = execute(cursor, query, params)
-        self._thread[self.thread_id][self.name]['uncommited'] = True
+        if self._primary(query) is False:
+            conn = self._replica()
+            if conn is not None:
+                conn['executed'] = True
+                try:
+                    result = execute(conn['cursor'], query, params)
+                except MySQLdb.OperationalError as e:
+                    if e.args[0] not in CONNECTION_LOST:
+                        raise
+                    self._lost(conn, e)
+                else:
+                    self._last = conn
+                    return result
+
+        conn = self._acquire()
+        self._started(conn, query)
+        result = execute(conn['cursor'], query, params)
+        self._last = conn
         return result
 
+    def executemany(self, query=None, params=None):
+        self._primary(query)
+        conn = self._acquire()
+        self._started(conn, query)
+        executemany(conn['cursor'], query, params)
+        self._last = conn
+
+    def _started(self, conn, query):
+        # Marked before the statement runs, a failed statement may still
+        # hold locks and the transaction must be rolled back.
+        conn['executed'] = True
+        if is_write(query):
+            conn['uncommited'] = True
+
+    def insert_many(self, table, fields, rows, max_packet=None):
+        return insert_many(self, table, fields, rows, max_packet)
+
+    def stream(self, query=None, params=None, batch=None):
+        """Iterate over the result of a query without buffering it.
+
+        Uses a server side cursor, rows are read from the server as the
+        generator is consumed. Yields a dictionary per row, or lists of up
+        to *batch* rows when *batch* is specified. Other queries cannot run
+        on the connection until the generator is exhausted or closed.
+        """
+        conn = None
+        if self._primary(query) is False:
+            conn = self._replica()
+        if conn is None:
+            conn = self._acquire()
+        cursor = conn['db'].cursor(MySQLdb.cursors.SSDictCursor)
+        self._started(conn, query)
+        try:
+            for rows in stream(cursor, query, params, batch):
+                yield rows
+        finally:
+            cursor.close()
+
+    def on_commit(self, callback):
+        """Call *callback* once the current transaction is committed.
+
+        Callbacks are discarded when the transaction is rolled back.
+        """
+        self._acquire()['on_commit'].add(callback)
+
+    def _end_replicas(self):
+        # Reads on replicas start from a new snapshot after the primary
+        # transaction ends.
+        for key in self._replica_keys():
+            if self._acquired(key):
+                end(self._thread[self.thread_id][key])
+
     def commit(self):
-        db = self._thread[self.thread_id][self.name]['db']
-        commit(db)
-        self._thread[self.thread_id][self.name]['uncommited'] = False
+        if self._acquired():
+            conn = self._thread[self.thread_id][self.name]
+            if conn['executed'] is True:
+                commit(conn['db'])
+            conn['executed'] = False
+            conn['uncommited'] = False
+            callbacks = conn['on_commit']
+            conn['on_commit'] = set()
+            for callback in callbacks:
+                callback()
+        self._end_replicas()
 
     def rollback(self):
-        db = self._thread[self.thread_id][self.name]['db']
-        rollback(db)
-        self._thread[self.thread_id][self.name]['uncommited'] = False
+        if self._acquired():
+            conn = self._thread[self.thread_id][self.name]
+            if conn['executed'] is True:
+                rollback(conn['db'])
+            conn['executed'] = False
+            conn['uncommited'] = False
+            conn['on_commit'] = set()
+        self._end_replicas()
+
+
+def _int(value):
+    if value is not None:
+        return int(value)
+
+
+def _float(value):
+    if value is not None:
+        return float(value)
+
+
+_READ = ('SELECT', 'SHOW', 'DESCRIBE', 'DESC', 'EXPLAIN')
+
+
+def is_write(query):
+    if query is None:
+        return False
+    statement = query.lstrip(' \t\r\n(').split(None, 1)
+    if len(statement) > 0 and statement[0].upper() in _READ:
+        return False
+    return True
+
+
+def is_locking(query):
+    # SELECT ... FOR UPDATE and LOCK IN SHARE MODE must run on the primary.
+    if query is None:
+        return False
+    query = query.upper()
+    return 'FOR UPDATE' in query or 'LOCK IN SHARE MODE' in query
+
+
+def end(conn):
+    # Ends the transaction of a checked out connection with the least
+    # work. Nothing is sent when no statement ran since the last commit
+    # or rollback. Otherwise uncommited work is discarded, a rollback
+    # costs the same round trip as a commit when only reads ran.
+    if conn['executed'] is True:
+        if conn['uncommited'] is True:
+            log.debug("Rolling back uncommited writes")
+        rollback(conn['db'])
+    conn['executed'] = False
+    conn['uncommited'] = False
+    conn['on_commit'] = set()
 
 
 def _log_query(query=None, params=None):
@@ -215,6 +631,118 @@ def execute(cursor, query=None, params=None):
     return result
 
 
+def executemany(cursor, query=None, params=None):
+    timer = nfw.utils.timer()
+
+    cursor.executemany(query, params)
+
+    timer = nfw.utils.timer(timer)
+    if timer > 0.1:
+        log.debug("SQL !SLOW! Query Many %s (ROWS: %s) (DURATION: %s)" %
+                  (query, len(params), timer))
+    else:
+        log.debug("SQL Query Many %s (ROWS: %s) (DURATION: %s)" %
+                  (query, len(params), timer))
+
+
+# Statement size budget for multi row inserts, well below the
+# max_allowed_packet default of MySQL 5.6 and later.
+MAX_PACKET = 1048576
+
+
+def _row_size(row):
+    size = 3
+    for value in row:
+        if value is None:
+            size += 5
+        else:
+            size += len(unicode(value)) + 3
+    return size
+
+
+def chunk_rows(rows, max_packet=None):
+    if max_packet is None:
+        max_packet = MAX_PACKET
+    chunk = []
+    size = 0
+    for row in rows:
+        row_size = _row_size(row)
+        if len(chunk) > 0 and size + row_size > max_packet:
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(row)
+        size += row_size
+    if len(chunk) > 0:
+        yield chunk
+
+
+def insert_many(db, table, fields, rows, max_packet=None):
+    """Insert rows with multi row INSERT statements.
+
+    *rows* is a sequence of value tuples in the order of *fields*. Rows
+    are sent in chunks that stay within *max_packet* bytes. Returns the
+    auto increment ids assigned. InnoDB allocates them for a single multi
+    row INSERT in steps of auto_increment_increment.
+    """
+    ids = []
+    increment = None
+    placeholder = "(%s)" % (",".join(['%s'] * len(fields)),)
+    for chunk in chunk_rows(rows, max_packet):
+        sql = "INSERT INTO %s (%s)" % (table, ",".join(fields)) +\
+              " VALUES %s" % (",".join([placeholder] * len(chunk)),)
+        values = []
+        for row in chunk:
+            values.extend(row)
+        db.execute(sql, tuple(values))
+        first = db.last_row_id()
+        if first:
+            if increment is None and len(chunk) > 1:
+                # Runs on the primary the INSERT pinned.
+                increment = auto_increment_increment(db)
+            ids.extend(range(first, first + len(chunk) * (increment or 1),
+                             increment or 1))
+        else:
+            ids.extend([None] * len(chunk))
+    return ids
+
+
+def auto_increment_increment(db):
+    # Greater than 1 on servers sharing auto increment ranges, such as
+    # multi master replication.
+    result = db.execute("SELECT @@auto_increment_increment AS increment")
+    return int(result[0]['increment'])
+
+
+def stream(cursor, query=None, params=None, batch=None):
+    timer = nfw.utils.timer()
+
+    log_query = _log_query(query, params)
+
+    cursor.execute(query, params)
+
+    timer = nfw.utils.timer(timer)
+    if timer > 0.1:
+        log.debug("SQL !SLOW! Stream %s (DURATION: %s)" % (log_query, timer))
+    else:
+        log.debug("SQL Stream %s (DURATION: %s)" % (log_query, timer))
+
+    if batch is None:
+        size = 1000
+    else:
+        size = batch
+
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        if batch is None:
+            for row in rows:
+                yield row
+        else:
+            yield rows
+
+
 def commit(db):
     timer = nfw.utils.timer()
     db.commit()
@@ -260,6 +788,11 @@ class Testing():
         self.execute_count = 0
         self._last_row_id = None
         self._last_row_count = None
+        self._uncommited = False
+        self._on_commit = set()
+
+    def in_transaction(self):
+        return self._uncommited
 
     def last_row_id(self):
         return self._last_row_id
@@ -281,11 +814,22 @@ class Testing():
     def commit(self):
         if len(self.queries) != self.execute_count:
             raise Exception("Not all test sql queries executed")
+        self._uncommited = False
+        callbacks = self._on_commit
+        self._on_commit = set()
+        for callback in callbacks:
+            callback()
 
     def rollback(self):
-        pass
+        self._uncommited = False
+        self._on_commit = set()
+
+    def on_commit(self, callback):
+        self._on_commit.add(callback)
 
     def execute(self, query, values=None):
+        if is_write(query):
+            self._uncommited = True
         q = self._query()
         if query != q.get('query'):
             raise Exception("Query not matched %s == %s" % (query, q.get('query')))
@@ -309,3 +853,15 @@ class Testing():
                 raise Exception("Values not matched")
 
         return q.get('result', [])
+
+    def insert_many(self, table, fields, rows, max_packet=None):
+        return insert_many(self, table, fields, rows, max_packet)
+
+    def stream(self, query, values=None, batch=None):
+        result = self.execute(query, values)
+        if batch is None:
+            for row in result:
+                yield row
+        else:
+            for i in range(0, len(result), batch):
+                yield result[i:i+batch]
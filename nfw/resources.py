@@ -36,6 +36,8 @@ from __future__ import unicode_literals
 
 import logging
 
+import nfw
+
 log = logging.getLogger(__name__)
 
 
@@ -46,3 +48,26 @@ class Middleware(object):
 
 class Resource(object):
     pass
+
+
+def conditional(validator):
+    """Decorate a view with a *validator* for conditional GET requests.
+
+    The validator is called as validator(req, resp, **kwargs) before the
+    view and sets the ETag or Last-Modified of the response. When they
+    match the request, 304 Not Modified is returned without running the
+    view.
+    """
+    def decorator(view):
+        view.validator = validator
+        return view
+    return decorator
+
+
+def cached(ttl=60, **kwargs):
+    """Cache the responses of a GET view on the server for *ttl* seconds.
+
+    Keyword arguments are those of nfw.cache.ResponseCache. The returned
+    cache decorates a view, or is passed to router.add() as *cache*.
+    """
+    return nfw.cache.ResponseCache(ttl, **kwargs)
@@ -34,8 +34,15 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import calendar
+from datetime import datetime
+from email.utils import formatdate
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
 import io
 import logging
+import mimetypes
+import os
 from StringIO import StringIO
 
 import nfw
@@ -46,12 +53,16 @@ log = logging.getLogger(__name__)
 class Response(object):
     _attributes = ['status']
 
-    def __init__(self):
+    def __init__(self, chunk_size=65536):
         self.status = nfw.HTTP_200
         super(Response, self).__setattr__('headers', nfw.Headers(request=False))
         self.headers['Content-Type'] = nfw.TEXT_HTML
         super(Response, self).__setattr__('_io', StringIO())
+        super(Response, self).__setattr__('_stream', None)
+        super(Response, self).__setattr__('_file', None)
+        super(Response, self).__setattr__('_range', None)
         super(Response, self).__setattr__('content_length', 0)
+        super(Response, self).__setattr__('chunk_size', chunk_size)
         self.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
         self.headers['Progma'] = 'no-cache'
         self.headers['Expires'] = 0
@@ -60,14 +71,190 @@ class Response(object):
         if name in self._attributes:
             super(Response, self).__setattr__(name, value)
         elif name == 'body':
-            self.clear()
-            super(Response, self).__setattr__('content_length', len(value))
-            super(Response, self).__setattr__('_io', StringIO())
-            self.write(value)
+            if isinstance(value, basestring):
+                self.clear()
+                self.write(value)
+            else:
+                self.stream(value)
         else:
             AttributeError("'response' object can't bind" +
                            " attribute '%s'" % (name,))
 
+    @property
+    def streaming(self):
+        return self._stream is not None
+
+    @property
+    def has_file(self):
+        return self._file is not None
+
+    def stream(self, iterable, length=None):
+        """Send the chunks of *iterable* as the body.
+
+        Chunks are passed to the server as they are produced and not
+        buffered. Without a *length* no Content-Length is sent and the
+        server uses chunked transfer encoding.
+        """
+        self.clear()
+        super(Response, self).__setattr__('_stream', iterable)
+        super(Response, self).__setattr__('content_length', length)
+
+    def file(self, f, content_type=None):
+        """Send a file as the body, *f* is a path or a file opened in
+        binary mode.
+
+        The file is handed to the server's wsgi.file_wrapper when
+        available, otherwise read in chunks. Content-Length, ETag and
+        Last-Modified are set from os.stat() and single byte ranges are
+        served.
+        """
+        if isinstance(f, basestring):
+            if content_type is None:
+                content_type = mimetypes.guess_type(f)[0]
+                if content_type is None:
+                    content_type = nfw.APPLICATION_OCTET_STREAM
+            f = open(f, 'rb')
+        self.clear()
+        stat = os.fstat(f.fileno())
+        super(Response, self).__setattr__('_file', f)
+        super(Response, self).__setattr__('content_length', stat.st_size)
+        if content_type is not None:
+            self.headers['Content-Type'] = content_type
+        self.headers['ETag'] = '"%x-%x"' % (int(stat.st_mtime),
+                                            stat.st_size)
+        self.headers['Last-Modified'] = formatdate(stat.st_mtime,
+                                                   usegmt=True)
+        self.headers['Accept-Ranges'] = 'bytes'
+
+    def cacheable(self, max_age=None, public=False):
+        """Allow clients to cache the response.
+
+        Without *max_age* clients revalidate on every request, which is
+        answered with 304 Not Modified when the ETag or Last-Modified of
+        the response did not change.
+        """
+        if public is True:
+            cache_control = 'public'
+        else:
+            cache_control = 'private'
+        if max_age is None:
+            cache_control += ', no-cache'
+        else:
+            cache_control += ', max-age=%s' % (int(max_age),)
+        self.headers['Cache-Control'] = cache_control
+        del self.headers['Progma']
+        del self.headers['Expires']
+
+    def etag(self, value, weak=False):
+        value = '"%s"' % (value.strip('"'),)
+        if weak is True:
+            value = 'W/' + value
+        self.headers['ETag'] = value
+
+    def last_modified(self, value):
+        # value is a UTC datetime or a timestamp.
+        if isinstance(value, datetime):
+            value = calendar.timegm(value.utctimetuple())
+        self.headers['Last-Modified'] = formatdate(value, usegmt=True)
+
+    def conditional(self, headers):
+        """Return 304 Not Modified when the request validators match.
+
+        *headers* are the request headers. Returns True when the
+        response was changed to 304.
+        """
+        if self.status != nfw.HTTP_200:
+            return False
+
+        if 'if_none_match' in headers:
+            etag = self.headers.get('ETag')
+            if etag is None:
+                return False
+            tags = headers.get('if_none_match')
+            if tags.strip() != '*' and _weak(etag) not in _etags(tags):
+                return False
+        elif ('if_modified_since' in headers and
+                'Last-Modified' in self.headers):
+            since = _timestamp(headers.get('if_modified_since'))
+            modified = _timestamp(self.headers.get('Last-Modified'))
+            if since is None or modified is None or modified > since:
+                return False
+        else:
+            return False
+
+        self.clear()
+        self.status = nfw.HTTP_304
+        # A 304 has no body and must not claim one.
+        super(Response, self).__setattr__('content_length', None)
+        return True
+
+    def range(self, header, if_range=None):
+        """Limit the body to the byte range in the Range *header*.
+
+        Applies to file bodies, and to buffered bodies with an ETag or
+        Last-Modified validator. Multiple ranges are not supported and
+        return the whole body.
+        """
+        if header is None or self.status != nfw.HTTP_200:
+            return
+        if self._file is None:
+            if (self._stream is not None or self.content_length == 0 or
+                    ('ETag' not in self.headers and
+                     'Last-Modified' not in self.headers)):
+                return
+        if (if_range is not None and
+                if_range != self.headers.get('ETag') and
+                if_range != self.headers.get('Last-Modified')):
+            return
+
+        size = self.content_length
+        byte_range = parse_range(header, size)
+        if byte_range is None:
+            return
+        elif byte_range is False:
+            self.clear()
+            self.status = nfw.HTTP_416
+            self.headers['Content-Range'] = 'bytes */%s' % (size,)
+            return
+
+        start, end = byte_range
+        self.status = nfw.HTTP_206
+        self.headers['Content-Range'] = 'bytes %s-%s/%s' % (start, end, size)
+        super(Response, self).__setattr__('_range', (start, end, size))
+        super(Response, self).__setattr__('content_length', end - start + 1)
+
+    def file_body(self, file_wrapper=None):
+        # The body of a file response as passed to the server.
+        f = self._file
+        if self._range is not None:
+            start, end, size = self._range
+            f.seek(start)
+            if end + 1 < size:
+                return ResponseFile(f, end - start + 1, self.chunk_size)
+        if file_wrapper is not None:
+            return file_wrapper(f, self.chunk_size or 65536)
+        return ResponseFile(f, self.content_length, self.chunk_size)
+
+    def compress(self, encoding, level=6):
+        """Compress the body with the content coding *encoding*.
+
+        Buffered bodies are compressed at once, streamed bodies chunk by
+        chunk as they are sent.
+        """
+        if self._stream is not None:
+            super(Response, self).__setattr__(
+                '_stream', nfw.compress.stream(self._stream, encoding, level))
+            super(Response, self).__setattr__('content_length', None)
+        else:
+            data = nfw.compress.compress(self._io.getvalue(), encoding, level)
+            self.clear()
+            self.write(data)
+        self.headers['Content-Encoding'] = encoding
+        # The compressed body is only semantically equal to the original.
+        etag = self.headers.get('ETag')
+        if etag is not None and not etag.startswith('W/'):
+            self.headers['ETag'] = 'W/' + etag
+
     def seek(self,position):
         self._io.seek(position)
 
@@ -78,16 +265,41 @@ class Response(object):
         return self._io.readline(size)
 
     def write(self, data):
+        if self._stream is not None or self._file is not None:
+            raise nfw.Error("Response body is streamed")
+        # Kept as UTF-8 so the length is in bytes and the body is not
+        # encoded again when sent.
+        data = nfw.utils.if_unicode_to_utf8(data)
         super(Response, self).__setattr__('content_length',
                                           len(data)+self.content_length)
         self._io.write(data)
 
     def clear(self):
+        # A replaced stream may hold a server side cursor.
+        self.close()
+        if self._file is not None:
+            self._file.close()
         super(Response, self).__setattr__('_io', StringIO())
+        super(Response, self).__setattr__('_stream', None)
+        super(Response, self).__setattr__('_file', None)
+        super(Response, self).__setattr__('_range', None)
+        super(Response, self).__setattr__('content_length', 0)
+
+    def close(self):
+        if hasattr(self._stream, 'close'):
+            self._stream.close()
 
     def __iter__(self):
+        if self._stream is not None:
+            return ResponseStream(self._stream)
+        if self._file is not None:
+            return iter(self.file_body())
+        if self._range is not None:
+            start, end, size = self._range
+            self._io.seek(start)
+            return ResponseFile(self._io, end - start + 1, self.chunk_size)
         self._io.seek(0)
-        return ResponseIoStream(self._io)
+        return ResponseIoStream(self._io, self.chunk_size)
 
 
 def ResponseIoStream(f, chunk_size=None):
@@ -100,3 +312,96 @@ def ResponseIoStream(f, chunk_size=None):
         if not chunk:
             break
         yield nfw.utils.if_unicode_to_utf8(chunk)
+
+
+def ResponseFile(f, length, chunk_size=None):
+    '''Generator reading up to length bytes of a file in chunks'''
+    if chunk_size is None:
+        chunk_size = 65536
+    try:
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _weak(etag):
+    # Weak comparison ignores the W/ prefix.
+    etag = etag.strip()
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    return etag
+
+
+def _etags(header):
+    return [_weak(etag) for etag in header.split(',')]
+
+
+def _timestamp(http_date):
+    parsed = parsedate_tz(http_date)
+    if parsed is not None:
+        return mktime_tz(parsed)
+    return None
+
+
+def parse_range(header, size):
+    """Return the inclusive (start, end) of a single byte range.
+
+    Returns None when the header is not a single byte range and False
+    when the range is outside of *size*.
+    """
+    unit, sep, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if sep == '' or not (first + last).isdigit():
+        return None
+    if first == '':
+        # Suffix range, the last bytes of the file.
+        length = int(last)
+        if length == 0:
+            return False
+        start = max(size - length, 0)
+        end = size - 1
+    else:
+        start = int(first)
+        if last == '':
+            end = size - 1
+        elif int(last) < start:
+            return None
+        else:
+            end = min(int(last), size - 1)
+    if start >= size:
+        return False
+    return (start, end)
+
+
+def ResponseStream(iterable):
+    '''Generator passing chunks of a streamed body through'''
+    for chunk in iterable:
+        if chunk:
+            yield nfw.utils.if_unicode_to_utf8(chunk)
+
+
+class ResponseClose(object):
+    """Iterable calling *callback* once the server closes it.
+
+    Lets the request clean up only after a streamed body was sent.
+    """
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.callback()
@@ -53,10 +53,111 @@ def view(uri, method, req, resp):
     else:
         raise nfw.HTTPNotFound(description=uri)
 
-class Router(object):
+
+def _int(value):
+    if not value.isdigit():
+        raise ValueError(value)
+    return int(value)
+
+
+def _slug(value):
+    if re.match('[A-Za-z0-9_-]+$', value) is None:
+        raise ValueError(value)
+    return value
+
+
+def _str(value):
+    return value
+
+
+class _Node(object):
+    # Prefix tree node. Static children are keyed by segment and always
+    # tried before capture children, which are keyed by converter name.
+    __slots__ = ('static', 'captures', 'route')
+
     def __init__(self):
+        self.static = {}
+        self.captures = []
+        self.route = None
+
+    def capture(self, converter):
+        for c, node in self.captures:
+            if c == converter:
+                return node
+        node = _Node()
+        self.captures.append((converter, node))
+        # Typed converters are more specific, try plain captures last.
+        self.captures.sort(key=lambda c: c[0] == 'str')
+        return node
+
+
+class Router(object):
+    converters = {
+        'str': _str,
+        'int': _int,
+        'slug': _slug
+    }
+
+    def __init__(self, cache=0):
 
         self.routes = []
+        self._tree = {}
+        if cache > 0:
+            self.cache = nfw.utils.LRU(cache)
+        else:
+            self.cache = None
+
+    def _compile(self, route):
+        segments = []
+        for v in route.split('/'):
+            if len(v) > 0 and v[0] == '{':
+                v = v.replace('{', '').replace('}', '')
+                if ':' in v:
+                    field, converter = v.split(':', 1)
+                else:
+                    field, converter = v, 'str'
+                segments.append((field, converter))
+            else:
+                segments.append(v)
+        return tuple(segments)
+
+    def _insert(self, r, segments):
+        method, route, obj, name = r
+        if method not in self._tree:
+            self._tree[method] = _Node()
+        node = self._tree[method]
+        fields = []
+        for segment in segments:
+            if isinstance(segment, tuple):
+                field, converter = segment
+                node = node.capture(converter)
+                fields.append(field)
+            else:
+                if segment not in node.static:
+                    node.static[segment] = _Node()
+                node = node.static[segment]
+        if node.route is not None:
+            raise nfw.Error('Adding duplicate API route %s' % (route))
+        node.route = (r, tuple(fields))
+
+    def _lookup(self, node, uri, i, values):
+        if i == len(uri):
+            return node.route
+        if uri[i] in node.static:
+            found = self._lookup(node.static[uri[i]], uri, i+1, values)
+            if found is not None:
+                return found
+        for converter, capture in node.captures:
+            try:
+                value = self.converters[converter](uri[i])
+            except ValueError:
+                continue
+            values.append(value)
+            found = self._lookup(capture, uri, i+1, values)
+            if found is not None:
+                return found
+            values.pop()
+        return None
 
     def _match(self, method, request_uri):
         if "?" in request_uri:
@@ -65,20 +166,22 @@ class Router(object):
         else:
             uri = request_uri.split('/')
 
-        for r in self.routes:
-            r_method, r_uri, r_obj, r_name = r
-            r_uri = r_uri.split('/')
-            if method == r_method:
-                if len(uri) == len(r_uri):
-                    kwargs = {}
-                    for (i, v) in enumerate(r_uri):
-                        if len(v) > 0 and v[0] == '{':
-                            v = v.replace('{', '').replace('}', '')
-                            kwargs[v] = uri[i]
-                        elif v != uri[i]:
-                            break
-                        if i+1 == len(r_uri):
-                            return [r, kwargs]
+        if self.cache is not None:
+            key = (method, '/'.join(uri))
+            cached = self.cache.get(key)
+            if cached is not None:
+                r, kwargs = cached
+                return [r, dict(kwargs)]
+
+        if method in self._tree:
+            values = []
+            found = self._lookup(self._tree[method], uri, 0, values)
+            if found is not None:
+                r, fields = found
+                kwargs = dict(zip(fields, values))
+                if self.cache is not None:
+                    self.cache.set(key, (r, kwargs))
+                return [r, dict(kwargs)]
         return None
 
     def route(self, req):
@@ -88,22 +191,37 @@ class Router(object):
         method = req.method
         return self._match(method, uri)
 
-    def add(self, method, route, obj, name=None):
+    def add(self, method, route, obj, name=None, cache=None):
         if re.search('\s', route):
             raise ValueError('Route may not include whitespace.')
         fields = re.findall('{([^}]*)}', route)
         for field in fields:
+            if ':' in field:
+                field, converter = field.split(':', 1)
+                if converter not in self.converters:
+                    raise ValueError("Unknown field converter '%s'." %
+                                     (converter,))
             is_identifier = re.match('[A-Za-z_][A-Za-z0-9_]+$', field)
             if not is_identifier or field in keyword.kwlist:
                 raise ValueError('Field names must be valid identifiers.')
 
+        if cache is not None:
+            obj = cache(obj)
+
         route = route.strip('/')
-        if self._match(method, route) is None:
-            r = []
-            r.append(method)
-            r.append(route)
-            r.append(obj)
-            r.append(name)
-            self.routes.append(r)
-        else:
-            raise nfw.Error('Adding duplicate API route %s' % (route))
+        r = []
+        r.append(method)
+        r.append(route)
+        r.append(obj)
+        r.append(name)
+        self._insert(r, self._compile(route))
+        self.routes.append(r)
+        if self.cache is not None:
+            self.cache.clear()
+
+    def cache_stats(self):
+        if self.cache is not None:
+            return {'hits': self.cache.hits,
+                    'misses': self.cache.misses,
+                    'size': len(self.cache)}
+        return None
@@ -35,4 +35,7 @@ from .general import random_id
 from .general import timer
 from .general import ObjectName
 from .general import import_module
+from .general import LRU
+from .general import Future
+from .general import Executor
 
@@ -35,9 +35,14 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import Queue
 import string
 import random
 import sys
+import threading
+from collections import OrderedDict
+
+import nfw
 
 
 def import_module(module):
@@ -96,3 +101,133 @@ def is_byte_string(string):
             return True
         else:
             return False
+
+
+class LRU(object):
+    """Thread safe bounded least recently used cache.
+
+    Keeps at most *size* items, discarding the least recently used item
+    when full. Lookups are counted in *hits* and *misses*.
+    """
+    def __init__(self, size=128):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            try:
+                self._data.pop(key)
+            except KeyError:
+                while len(self._data) >= self.size:
+                    self._data.popitem(last=False)
+            self._data[key] = value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Future(object):
+    """Result of a call submitted to an Executor."""
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise nfw.Error("Timeout waiting for result")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise nfw.Error("Timeout waiting for result")
+        return self._exception
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _set(self, result=None, exception=None):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for fn in callbacks:
+            fn(self)
+
+
+class Executor(object):
+    """Runs submitted calls on at most *workers* threads.
+
+    Threads are started as calls are submitted and kept for the life of
+    the process. submit() returns a Future.
+    """
+    def __init__(self, workers=32):
+        self.workers = workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._idle = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        with self._lock:
+            if (self._idle < self._queue.qsize() and
+                    len(self._threads) < self.workers):
+                t = threading.Thread(target=self._worker)
+                t.daemon = True
+                self._threads.append(t)
+                t.start()
+        return future
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+            future, fn, args, kwargs = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                future._set(exception=e)
+            else:
+                future._set(result)
@@ -43,24 +43,26 @@ class Base(nfw.ModelDict):
 
         if isinstance(request, nfw.Request):
             values = request.post
-            for v in values:
-                if hasattr(self, v):
-                    field = getattr(self, v)
-                    if field.readonly is False:
-                        if isinstance(field, nfw.ModelDict.Bool):
-                            self._set({v: True})
-                        elif isinstance(field, nfw.ModelDict.Integer):
-                            try:
-                                self._set({v: long(values[v].value)})
-                            except:
+            # Post values are written to the database once per row.
+            with self.batch():
+                for v in values:
+                    if hasattr(self, v):
+                        field = getattr(self, v)
+                        if field.readonly is False:
+                            if isinstance(field, nfw.ModelDict.Bool):
+                                self._set({v: True})
+                            elif isinstance(field, nfw.ModelDict.Integer):
+                                try:
+                                    self._set({v: long(values[v].value)})
+                                except:
+                                    self._set({v: values[v].value})
+                            elif isinstance(field, nfw.ModelDict.Number):
+                                try:
+                                    self._set({v: float(values[v].value)})
+                                except:
+                                    self._set({v: values[v].value})
+                            else:
                                 self._set({v: values[v].value})
-                        elif isinstance(field, nfw.ModelDict.Number):
-                            try:
-                                self._set({v: float(values[v].value)})
-                            except:
-                                self._set({v: values[v].value})
-                        else:
-                            self._set({v: values[v].value})
 
     def __str__(self):
         dom = nfw.web.Dom()
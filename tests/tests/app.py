@@ -0,0 +1,355 @@
+# Neutrino Framework
+#
+# Copyright (c) 2016, Christiaan Frans Rademan
+# All rights reserved.
+#
+# LICENSE: (BSD3-Clause)
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENTSHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+from email.utils import formatdate
+import logging
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+import unittest
+
+import nfw
+
+log = logging.getLogger(__name__)
+
+class FileWrapper(object):
+    # Server file wrapper, which may send the file with sendfile.
+    def __init__(self, f, block_size):
+        self.f = f
+        self.block_size = block_size
+
+    def __iter__(self):
+        return iter(lambda: self.f.read(self.block_size), '')
+
+    def close(self):
+        self.f.close()
+
+
+SETTINGS = """[application]
+name = test
+modules =
+workers = 2
+chunk_size = 4
+
+[logging]
+debug = false
+"""
+
+class App(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        settings = os.path.join(self.path, 'settings.cfg')
+        with open(settings, 'w') as f:
+            f.write(SETTINGS)
+        self._config = nfw.config.nfw_config
+        self._environ = os.environ.get('NEUTRINO_CONFIG')
+        os.environ['NEUTRINO_CONFIG'] = settings
+        self.app = nfw.Wsgi()
+        self.cleanups = []
+        self.app._cleanup = lambda: self.cleanups.append(True)
+
+    def tearDown(self):
+        nfw.config.nfw_config = self._config
+        if self._environ is None:
+            del os.environ['NEUTRINO_CONFIG']
+        else:
+            os.environ['NEUTRINO_CONFIG'] = self._environ
+        shutil.rmtree(self.path)
+
+    def environ(self, path, method=nfw.HTTP_GET, headers=None, **environ):
+        env = {'REQUEST_METHOD': method,
+               'PATH_INFO': path,
+               'SCRIPT_NAME': '',
+               'QUERY_STRING': '',
+               'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '80',
+               'REMOTE_ADDR': '127.0.0.1',
+               'wsgi.input': StringIO(),
+               'wsgi.url_scheme': 'http'}
+        for header in headers or {}:
+            env['HTTP_' + header.upper().replace('-', '_')] = headers[header]
+        env.update(environ)
+        return env
+
+    def request(self, path, method=nfw.HTTP_GET, headers=None, **environ):
+        # Returns status, headers and body of a request to the app.
+        env = self.environ(path, method, headers, **environ)
+        started = []
+
+        def start_response(status, headers):
+            started.append((status, dict(headers)))
+
+        returned = self.app._interface(env, start_response)
+        try:
+            body = ''.join(returned)
+        finally:
+            if hasattr(returned, 'close'):
+                returned.close()
+        status, headers = started[0]
+        return status, headers, body
+
+    def test_asgi(self):
+        def echo(req, resp):
+            resp.headers['Content-Type'] = nfw.TEXT_PLAIN
+            resp.write(req.read())
+
+        self.app.router.add(nfw.HTTP_POST, '/echo', echo)
+        received = [{'type': 'http.request', 'body': 'Hello ',
+                     'more_body': True},
+                    {'type': 'http.request', 'body': 'World'}]
+        sent = []
+        scope = {'type': 'http',
+                 'method': nfw.HTTP_POST,
+                 'path': '/echo',
+                 'headers': [('content-length', '11')]}
+        future = self.app.asgi()(scope, lambda: received.pop(0), sent.append)
+        future.result(10)
+
+        self.assertEqual(sent[0]['type'], 'http.response.start')
+        self.assertEqual(sent[0]['status'], 200)
+        headers = dict(sent[0]['headers'])
+        self.assertEqual(headers['content-length'], '11')
+        self.assertEqual(headers['content-type'], nfw.TEXT_PLAIN)
+        self.assertEqual(''.join(m['body'] for m in sent[1:]), 'Hello World')
+        self.assertEqual(sent[-1]['more_body'], False)
+        self.assertEqual(self.cleanups, [True])
+
+    def test_asgi_disconnect(self):
+        views = []
+        self.app.router.add(nfw.HTTP_POST, '/echo', views.append)
+        sent = []
+        scope = {'type': 'http', 'method': nfw.HTTP_POST, 'path': '/echo'}
+        future = self.app.asgi()(scope,
+                                 lambda: {'type': 'http.disconnect'},
+                                 sent.append)
+        self.assertEqual(future.result(10), None)
+        self.assertEqual(views, [])
+        self.assertEqual(sent, [])
+
+        scope = {'type': 'websocket', 'path': '/echo'}
+        future = self.app.asgi()(scope, None, sent.append)
+        self.assertRaises(nfw.Error, future.result, 10)
+
+    def test_asgi_cleanup(self):
+        def stream(req, resp):
+            resp.body = iter(['a', 'b', 'c'])
+
+        def send(message):
+            # The client went away while the body is sent.
+            if message['type'] == 'http.response.body':
+                raise IOError('Connection reset')
+
+        self.app.router.add(nfw.HTTP_GET, '/stream', stream)
+        scope = {'type': 'http', 'method': nfw.HTTP_GET, 'path': '/stream'}
+        future = self.app.asgi()(scope, lambda: {'type': 'http.request'},
+                                 send)
+        self.assertRaises(IOError, future.result, 10)
+        self.assertEqual(self.cleanups, [True])
+
+    def test_stream(self):
+        def buffered(req, resp):
+            resp.headers['Content-Type'] = nfw.TEXT_PLAIN
+            resp.write('Hello World')
+
+        def stream(req, resp):
+            resp.headers['Content-Type'] = nfw.TEXT_PLAIN
+            resp.body = iter(['Hello', ' ', 'World'])
+
+        self.app.router.add(nfw.HTTP_GET, '/buffered', buffered)
+        self.app.router.add(nfw.HTTP_GET, '/stream', stream)
+
+        status, headers, body = self.request('/buffered')
+        self.assertEqual(headers['Content-Length'], '11')
+        self.assertEqual(body, 'Hello World')
+        self.assertEqual(self.cleanups, [True])
+
+        started = []
+        returned = self.app._interface(self.environ('/stream'),
+                                       lambda s, h: started.append(h))
+        self.assertFalse('Content-Length' in dict(started[0]))
+        self.assertEqual(list(returned), ['Hello', ' ', 'World'])
+        # Connections are released once the server closed the body.
+        self.assertEqual(self.cleanups, [True])
+        returned.close()
+        self.assertEqual(self.cleanups, [True, True])
+
+    def test_file(self):
+        name = os.path.join(self.path, 'file.txt')
+        with open(name, 'wb') as f:
+            f.write('Hello World')
+        stat = os.stat(name)
+        files = []
+
+        def download(req, resp):
+            files.append(open(name, 'rb'))
+            resp.file(files[-1], nfw.TEXT_PLAIN)
+
+        self.app.router.add(nfw.HTTP_GET, '/file', download)
+
+        for wrapper in (None, FileWrapper):
+            environ = {}
+            if wrapper is not None:
+                environ['wsgi.file_wrapper'] = wrapper
+            started = []
+            returned = self.app._interface(self.environ('/file', **environ),
+                                           lambda s, h: started.append(h))
+            headers = dict(started[0])
+            self.assertEqual(headers['Content-Length'], '11')
+            self.assertEqual(headers['etag'],
+                             '"%x-%x"' % (int(stat.st_mtime), 11))
+            self.assertTrue('last-modified' in headers)
+            if wrapper is not None:
+                self.assertTrue(isinstance(returned, FileWrapper))
+                self.assertEqual(returned.block_size, 4)
+            self.assertEqual(''.join(returned), 'Hello World')
+            if hasattr(returned, 'close'):
+                returned.close()
+            self.assertTrue(files[-1].closed)
+        self.assertEqual(self.cleanups, [True, True])
+
+    def test_conditional(self):
+        runs = []
+
+        def page(req, resp):
+            runs.append(True)
+            resp.headers['Content-Type'] = nfw.TEXT_PLAIN
+            resp.cacheable()
+            resp.etag('v1')
+            resp.last_modified(1000000000)
+            resp.write('Hello World')
+
+        self.app.router.add(nfw.HTTP_GET, '/page', page)
+
+        for etag in ('"v1"', 'W/"v1"', '"v0", "v1"', '*'):
+            status, headers, body = self.request(
+                '/page', headers={'If-None-Match': etag})
+            self.assertEqual(status, nfw.HTTP_304)
+            self.assertEqual(body, '')
+            self.assertFalse('Content-Length' in headers)
+            self.assertEqual(headers['etag'], '"v1"')
+
+        # If-None-Match takes precedence over If-Modified-Since.
+        status, headers, body = self.request(
+            '/page', headers={'If-None-Match': '"v0"',
+                              'If-Modified-Since': formatdate(1000000000)})
+        self.assertEqual(status, nfw.HTTP_200)
+        self.assertEqual(body, 'Hello World')
+
+        status, headers, body = self.request(
+            '/page', headers={'If-Modified-Since': formatdate(1000000000)})
+        self.assertEqual(status, nfw.HTTP_304)
+        status, headers, body = self.request(
+            '/page', headers={'If-Modified-Since': formatdate(999999999)})
+        self.assertEqual(status, nfw.HTTP_200)
+        status, headers, body = self.request(
+            '/page', headers={'If-Modified-Since': 'yesterday'})
+        self.assertEqual(status, nfw.HTTP_200)
+        self.assertEqual(len(runs), 8)
+
+        # Responses are only validated for GET requests.
+        self.app.router.add(nfw.HTTP_POST, '/page', page)
+        status, headers, body = self.request(
+            '/page', nfw.HTTP_POST, {'If-None-Match': '"v1"'})
+        self.assertEqual(status, nfw.HTTP_200)
+
+    def test_conditional_validator(self):
+        runs = []
+
+        def validator(req, resp, id):
+            resp.cacheable()
+            resp.etag('v%s' % (id,))
+
+        @nfw.conditional(validator)
+        def post(req, resp, id):
+            runs.append(id)
+            resp.write('Post %s' % (id,))
+
+        self.app.router.add(nfw.HTTP_GET, '/post/{id}', post)
+        status, headers, body = self.request(
+            '/post/1', headers={'If-None-Match': '"v1"'})
+        self.assertEqual(status, nfw.HTTP_304)
+        self.assertEqual(runs, [])
+
+        status, headers, body = self.request(
+            '/post/2', headers={'If-None-Match': '"v1"'})
+        self.assertEqual(status, nfw.HTTP_200)
+        self.assertEqual(body, 'Post 2')
+        self.assertEqual(headers['etag'], '"v2"')
+        self.assertEqual(runs, ['2'])
+
+    def test_range(self):
+        def page(req, resp):
+            resp.headers['Content-Type'] = nfw.TEXT_PLAIN
+            resp.etag('v1')
+            resp.write('Hello World')
+
+        def unvalidated(req, resp):
+            resp.write('Hello World')
+
+        self.app.router.add(nfw.HTTP_GET, '/page', page)
+        self.app.router.add(nfw.HTTP_GET, '/unvalidated', unvalidated)
+
+        status, headers, body = self.request(
+            '/page', headers={'Range': 'bytes=6-'})
+        self.assertEqual(status, nfw.HTTP_206)
+        self.assertEqual(headers['content-range'], 'bytes 6-10/11')
+        self.assertEqual(headers['Content-Length'], '5')
+        self.assertEqual(body, 'World')
+
+        status, headers, body = self.request(
+            '/page', headers={'Range': 'bytes=0-4', 'If-Range': '"v1"'})
+        self.assertEqual(status, nfw.HTTP_206)
+        self.assertEqual(body, 'Hello')
+
+        # The whole body when the If-Range validator changed.
+        status, headers, body = self.request(
+            '/page', headers={'Range': 'bytes=0-4', 'If-Range': '"v0"'})
+        self.assertEqual(status, nfw.HTTP_200)
+        self.assertEqual(body, 'Hello World')
+
+        status, headers, body = self.request(
+            '/page', headers={'Range': 'bytes=11-'})
+        self.assertEqual(status, nfw.HTTP_416)
+        self.assertEqual(headers['content-range'], 'bytes */11')
+        self.assertEqual(body, '')
+
+        for header in ('bytes=0-1,4-5', 'bytes=4-1', 'lines=1-2'):
+            status, headers, body = self.request(
+                '/page', headers={'Range': header})
+            self.assertEqual(status, nfw.HTTP_200)
+            self.assertEqual(body, 'Hello World')
+
+        # Buffered bodies without a validator are sent whole.
+        status, headers, body = self.request(
+            '/unvalidated', headers={'Range': 'bytes=0-4'})
+        self.assertEqual(status, nfw.HTTP_200)
+        self.assertEqual(body, 'Hello World')
@@ -0,0 +1,174 @@
+# Neutrino Framework
+#
+# Copyright (c) 2016, Christiaan Frans Rademan
+# All rights reserved.
+#
+# LICENSE: (BSD3-Clause)
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENTSHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import logging
+import threading
+import unittest
+
+import nfw
+
+log = logging.getLogger(__name__)
+
+class Request(object):
+    def __init__(self, path, query='', headers=None, session=None):
+        self.environ = {'SCRIPT_NAME': '',
+                        'PATH_INFO': path,
+                        'QUERY_STRING': query}
+        self.headers = nfw.Headers()
+        for header in headers or {}:
+            self.headers[header] = headers[header]
+        self.session = session or {}
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ResponseCache(unittest.TestCase):
+    def test_key(self):
+        cache = nfw.cached(60, headers=('Accept-Language',),
+                           session=('user',))
+        key = cache.key(Request('/blog', 'a=1&b=2',
+                                {'Accept-Language': 'en'}))
+        self.assertEqual(key, cache.key(Request('/blog', 'b=2&a=1',
+                                                {'Accept-Language': 'en'})))
+        self.assertNotEqual(key, cache.key(Request('/blog', 'a=1&b=2',
+                                                   {'Accept-Language': 'de'})))
+        self.assertNotEqual(key, cache.key(Request('/blog', 'a=1&b=2',
+                                                   {'Accept-Language': 'en'},
+                                                   {'user': 'admin'})))
+        self.assertNotEqual(key, cache.key(Request('/blog', 'a=1&b=2',
+                                                   {'Accept-Language': 'en'}),
+                                           'menu'))
+        cache = nfw.cached(60, query=False)
+        self.assertEqual(cache.key(Request('/blog', 'a=1')),
+                         cache.key(Request('/blog', 'a=2')))
+
+    def test_fetch(self):
+        clock = Clock()
+        cache = nfw.cached(60, stale=600, clock=clock)
+        calls = []
+
+        def produce():
+            calls.append(None)
+            return len(calls)
+
+        self.assertEqual(cache.fetch('key', produce), 1)
+        self.assertEqual(cache.fetch('key', produce), 1)
+        self.assertEqual(cache.fetch('other', lambda: None), None)
+        self.assertEqual(cache.fetch('other', lambda: 2), 2)
+
+        # Expired entries are regenerated.
+        clock.now += 61
+        self.assertEqual(cache.fetch('key', produce), 2)
+        self.assertEqual(cache.fetch('key', produce), 2)
+
+        # Beyond the stale period callers do not get the old entry.
+        clock.now += 661
+        self.assertEqual(cache.fetch('key', produce), 3)
+        self.assertEqual(len(calls), 3)
+
+    def test_fetch_stale(self):
+        clock = Clock()
+        cache = nfw.cached(60, stale=600, clock=clock)
+        self.assertEqual(cache.fetch('key', lambda: 'old'), 'old')
+        clock.now += 61
+
+        # Stale entries are served while one caller regenerates.
+        producing = threading.Event()
+        release = threading.Event()
+
+        def produce():
+            producing.set()
+            release.wait(10)
+            return 'new'
+
+        results = []
+        regenerate = threading.Thread(
+            target=lambda: results.append(cache.fetch('key', produce)))
+        regenerate.start()
+        producing.wait(10)
+        self.assertEqual(cache.fetch('key', produce), 'old')
+        release.set()
+        regenerate.join()
+        self.assertEqual(results, ['new'])
+        self.assertEqual(cache.fetch('key', produce), 'new')
+
+    def test_fetch_single_flight(self):
+        cache = nfw.cached(60, clock=Clock())
+        producing = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def produce():
+            calls.append(None)
+            producing.set()
+            release.wait(10)
+            return len(calls)
+
+        # Missing entries are produced once, other callers wait.
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(cache.fetch('key', produce)))
+            for i in range(4)]
+        threads[0].start()
+        producing.wait(10)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [1, 1, 1, 1])
+        self.assertEqual(len(calls), 1)
+
+    def test_respond(self):
+        cache = nfw.cached(60, clock=Clock())
+
+        def view(req, resp):
+            resp.headers['Content-Type'] = nfw.APPLICATION_JSON
+            resp.body = '[]'
+
+        resp = nfw.Response()
+        cache.respond(view, Request('/list'), resp, {})
+
+        # Cached headers replace those of the response, other headers
+        # set before the view are kept.
+        resp = nfw.Response()
+        resp.headers['X-Request-Id'] = 'abc'
+        cache.respond(lambda req, resp: None, Request('/list'), resp, {})
+        self.assertEqual(resp.headers['Content-Type'], nfw.APPLICATION_JSON)
+        self.assertEqual(resp.headers['X-Request-Id'], 'abc')
+        resp.seek(0)
+        self.assertEqual(resp.read(), '[]')
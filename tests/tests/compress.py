@@ -0,0 +1,68 @@
+# Neutrino Framework
+#
+# Copyright (c) 2016, Christiaan Frans Rademan
+# All rights reserved.
+#
+# LICENSE: (BSD3-Clause)
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENTSHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import logging
+import unittest
+import zlib
+
+import nfw
+
+log = logging.getLogger(__name__)
+
+class Compress(unittest.TestCase):
+    def test_negotiate(self):
+        negotiate = nfw.compress.negotiate
+        self.assertEqual(negotiate('gzip, deflate', ('gzip', 'deflate')),
+                         'gzip')
+        self.assertEqual(negotiate('gzip;q=0.5, deflate',
+                                   ('gzip', 'deflate')), 'deflate')
+        self.assertEqual(negotiate('gzip;q=0', ('gzip', 'deflate')), None)
+        self.assertEqual(negotiate('*', ('gzip', 'deflate')), 'gzip')
+        self.assertEqual(negotiate('identity', ('gzip', 'deflate')), None)
+        self.assertEqual(negotiate('', ('gzip', 'deflate')), None)
+
+    def test_compress(self):
+        data = 'Neutrino ' * 100
+        gzipped = nfw.compress.compress(data, 'gzip')
+        self.assertEqual(zlib.decompress(gzipped, 16 + zlib.MAX_WBITS), data)
+        deflated = nfw.compress.compress(data, 'deflate')
+        self.assertEqual(zlib.decompress(deflated), data)
+
+    def test_stream(self):
+        chunks = ['Neutrino ' * 10, '', u'Framework ' * 10]
+        compressed = list(nfw.compress.stream(iter(chunks), 'gzip'))
+        self.assertEqual(len(compressed), 3)
+        self.assertEqual(zlib.decompress(''.join(compressed),
+                                         16 + zlib.MAX_WBITS),
+                         'Neutrino ' * 10 + 'Framework ' * 10)
+        # Flushed chunks decompress as they arrive.
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(d.decompress(compressed[0]), 'Neutrino ' * 10)
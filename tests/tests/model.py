@@ -29,6 +29,8 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
+from datetime import datetime
+import json
 import logging
 import unittest
 
@@ -81,7 +83,7 @@ class Model(unittest.TestCase):
 
         # LIST MODEL: QUERY DATABASE FOR RECORDS
         q = {}
-        q['query'] = "SELECT firstname, lastname, submodel FROM Model"
+        q['query'] = "SELECT firstname, lastname, submodel, id FROM Model"
         testtable = []
         testrow = {}
         testtable.append(testrow)
@@ -135,45 +137,12 @@ class Model(unittest.TestCase):
         q['values'] = [43,]
         queries.append(q)
 
-        q = {}
-        q['query'] = "SELECT age, id FROM SubModel WHERE id = %s"
-        q['values'] = [43,]
-        testtable = []
-        testrow = {}
-        testtable.append(testrow)
-        testrow['id'] = 43
-        testrow['age'] = 43
-        q['result'] = testtable
-        queries.append(q)
-
-        q = {}
-        q['query'] = "SELECT age, id FROM SubModel WHERE id = %s"
-        q['values'] = [43,]
-        testtable = []
-        testrow = {}
-        testtable.append(testrow)
-        testrow['id'] = 43
-        testrow['age'] = 43
-        q['result'] = testtable
-        queries.append(q)
-
         q = {}
         q['query'] = "INSERT INTO Model (submodel) VALUES (%s)"
         q['values'] = [43,]
         q['last_row_id'] = 3
         queries.append(q)
 
-        q = {}
-        q['query'] = "SELECT firstname, lastname, submodel, id FROM Model WHERE id = %s"
-        q['values'] = [3,]
-        testtable = []
-        testrow = {}
-        testtable.append(testrow)
-        testrow['id'] = 3
-        testrow['submodel'] = 43
-        q['result'] = testtable
-        queries.append(q)
-
         q = {}
         q['query'] = "UPDATE Model SET firstname=%s,lastname=%s WHERE id = %s"
         q['values'] = ['Mark','Shuttleworth', 3]
@@ -202,19 +171,6 @@ class Model(unittest.TestCase):
         q['result'] = testtable
         queries.append(q)
 
-        q = {}
-        q['query'] = "SELECT firstname, lastname, submodel, id FROM Model WHERE id = %s"
-        q['values'] = [1,]
-        testtable = []
-        testrow = {}
-        testtable.append(testrow)
-        testrow['id'] = 1
-        testrow['firstname'] = 'Jane'
-        testrow['lastname'] = 'Doe'
-        testrow['submodel'] = 43
-        q['result'] = testtable
-        queries.append(q)
-
         q = {}
         q['query'] = "UPDATE Model SET submodel=%s WHERE id = %s"
         q['values'] = [43,1]
@@ -233,34 +189,12 @@ class Model(unittest.TestCase):
         queries.append(q)
 
         # LIST MODEL: UPDATE FIELD
-        q = {}
-        q['query'] = "SELECT firstname, lastname, submodel, id FROM Model WHERE id = %s"
-        q['values'] = [1,]
-        testtable = []
-        testrow = {}
-        testtable.append(testrow)
-        testrow['id'] = 1
-        testrow['lastname'] = 'Doe'
-        q['result'] = testtable
-        queries.append(q)
-
         q = {}
         q['query'] = "UPDATE Model SET firstname=%s WHERE id = %s"
         q['values'] = ['Bean',1]
         queries.append(q)
 
         # LIST MODEL: UPDATE SUB MODEL
-        q = {}
-        q['query'] = "SELECT age, id FROM SubModel WHERE id = %s"
-        q['values'] = [43,]
-        testtable = []
-        testrow = {}
-        testtable.append(testrow)
-        testrow['id'] = 43
-        testrow['age'] = 43
-        q['result'] = testtable
-        queries.append(q)
-
         q = {}
         q['query'] = "UPDATE SubModel SET age=%s WHERE id = %s"
         q['values'] = [83,43]
@@ -321,3 +255,766 @@ class Model(unittest.TestCase):
             if i == 1:
                 self.assertEqual(row['firstname'].value(), 'Mark')
                 self.assertEqual(row['submodel']['age'].value(), 83)
+
+        db.commit()
+
+    def test_modellist_stream(self):
+        queries = []
+
+        # LIST MODEL: STREAM RECORDS FROM DATABASE
+        q = {}
+        q['query'] = "SELECT firstname, lastname, id FROM Model"
+        testtable = []
+        for i in range(3):
+            testrow = {}
+            testrow['id'] = i
+            testrow['firstname'] = 'John'
+            testrow['lastname'] = 'Doe'
+            testtable.append(testrow)
+        q['result'] = testtable
+        queries.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+
+        class Model(nfw.Model):
+            firstname = nfw.Model.Text(required=True)
+            lastname = nfw.Model.Text(required=True)
+
+        model = Model(db=db)
+
+        # LIST MODEL: STREAM ROWS WITHOUT LOADING THEM INTO THE MODEL
+        count = 0
+        for row in model.stream():
+            self.assertEqual(row['firstname'].value(), 'John')
+            count += 1
+        self.assertEqual(count, 3)
+        self.assertEqual(len(list(model)), 0)
+
+        db.commit()
+
+    def test_modellist_stream_nested(self):
+        queries = []
+
+        # LIST MODEL: STREAM RECORDS WITHOUT QUERYING NESTED MODELS
+        q = {}
+        q['query'] = "SELECT firstname, submodel, id FROM Model"
+        testtable = []
+        for i in range(2):
+            testrow = {}
+            testrow['id'] = i
+            testrow['firstname'] = 'John'
+            testrow['submodel'] = 40 + i
+            testtable.append(testrow)
+        q['result'] = testtable
+        queries.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+
+        class SubModel(nfw.ModelDict):
+            age = nfw.Model.Integer(required=True)
+
+        class Model(nfw.Model):
+            firstname = nfw.Model.Text()
+            submodel = SubModel(db=db, foreign_key='id')
+
+        model = Model(db=db)
+
+        # NESTED FIELDS HOLD THE KEY VALUE
+        rows = list(model.stream())
+        self.assertEqual(rows[0]['submodel'].value(), 40)
+        self.assertEqual(rows[1].to_python()['submodel'], 41)
+
+        db.commit()
+
+    def test_modellist_extend(self):
+        queries = []
+
+        # LIST MODEL: BULK INSERT RECORDS
+        q = {}
+        q['query'] = "INSERT INTO Model (firstname,lastname) VALUES (%s,%s),(%s,%s)"
+        q['values'] = ['John', 'Doe', 'Jane', 'Doe']
+        q['last_row_id'] = 10
+        queries.append(q)
+
+        q = {}
+        q['query'] = "SELECT @@auto_increment_increment AS increment"
+        q['result'] = [{'increment': 1}]
+        queries.append(q)
+
+        q = {}
+        q['query'] = "INSERT INTO Model (firstname) VALUES (%s)"
+        q['values'] = ['Mark']
+        q['last_row_id'] = 12
+        queries.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+
+        class Model(nfw.Model):
+            firstname = nfw.Model.Text(required=True)
+            lastname = nfw.Model.Text(required=True)
+
+        model = Model(db=db)
+
+        # LIST MODEL: BULK INSERT RECORDS
+        ids = model.extend([{'firstname': 'John', 'lastname': 'Doe'},
+                            {'firstname': 'Mark'},
+                            {'firstname': 'Jane', 'lastname': 'Doe'}])
+        self.assertEqual(ids, [10, 12, 11])
+        self.assertEqual(model[2]['id'].value(), 11)
+        self.assertEqual(model[2]['firstname'].value(), 'Jane')
+
+        db.commit()
+
+    def test_modellist_extend_order(self):
+        queries = []
+
+        # LIST MODEL: ROWS BEFORE THE NESTED ROW
+        q = {}
+        q['query'] = "INSERT INTO Model (firstname) VALUES (%s)"
+        q['values'] = ['John']
+        q['last_row_id'] = 10
+        queries.append(q)
+
+        # LIST MODEL: NESTED ROW
+        q = {}
+        q['query'] = "INSERT INTO SubModel (age) VALUES (%s)"
+        q['values'] = [33]
+        q['last_row_id'] = 22
+        queries.append(q)
+
+        q = {}
+        q['query'] = "INSERT INTO Model (submodel) VALUES (%s)"
+        q['values'] = [22]
+        q['last_row_id'] = 11
+        queries.append(q)
+
+        # LIST MODEL: ROWS AFTER THE NESTED ROW
+        q = {}
+        q['query'] = "INSERT INTO Model (firstname) VALUES (%s)"
+        q['values'] = ['Jane']
+        q['last_row_id'] = 12
+        queries.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+
+        class SubModel(nfw.ModelDict):
+            age = nfw.Model.Integer(required=True)
+
+        class Model(nfw.Model):
+            firstname = nfw.Model.Text()
+            submodel = SubModel(db=db, foreign_key='id')
+
+        model = Model(db=db)
+        ids = model.extend([{'firstname': 'John'},
+                            {'submodel': {'age': 33}},
+                            {'firstname': 'Jane'}])
+        self.assertEqual(ids, [10, 11, 12])
+        self.assertEqual(model[0]['firstname'].value(), 'John')
+        self.assertEqual(model[1]['submodel']['age'].value(), 33)
+        self.assertEqual(model[2]['firstname'].value(), 'Jane')
+        self.assertEqual([row['id'].value() for row in model], [10, 11, 12])
+
+        db.commit()
+
+    def test_modeldict_batch(self):
+        queries = []
+
+        # DICT MODEL: QUERY DATABASE FOR RECORDS
+        q = {}
+        q['query'] = "SELECT firstname, lastname, id FROM Model WHERE id = %s"
+        q['values'] = [1,]
+        testtable = []
+        testrow = {}
+        testtable.append(testrow)
+        testrow['id'] = 1
+        testrow['firstname'] = 'John'
+        testrow['lastname'] = 'Doe'
+        q['result'] = testtable
+        queries.append(q)
+
+        # DICT MODEL: UPDATE LOADED RECORD WITHOUT EXISTENCE CHECK
+        q = {}
+        q['query'] = "UPDATE Model SET firstname=%s WHERE id = %s"
+        q['values'] = ['Jane', 1]
+        queries.append(q)
+
+        # DICT MODEL: BATCH UPDATES INTO ONE STATEMENT
+        q = {}
+        q['query'] = "UPDATE Model SET firstname=%s,lastname=%s WHERE id = %s"
+        q['values'] = ['Mark', 'Shuttleworth', 1]
+        queries.append(q)
+
+        # DICT MODEL: UPSERT RECORD WITH KNOWN PRIMARY KEY
+        q = {}
+        q['query'] = "INSERT INTO Model (firstname,id) VALUES (%s,%s)" +\
+                     " ON DUPLICATE KEY UPDATE firstname=VALUES(firstname)"
+        q['values'] = ['Bean', 2]
+        queries.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+
+        class ModelDict(nfw.ModelDict):
+            class Meta:
+                db_table = 'Model'
+
+            firstname = nfw.Model.Text(required=True)
+            lastname = nfw.Model.Text(required=True)
+
+        modeldict = ModelDict(db=db, id=1)
+        modeldict.query()
+        modeldict['firstname'] = 'Jane'
+
+        with modeldict.batch():
+            modeldict['firstname'] = 'Mark'
+            modeldict['lastname'] = 'Shuttleworth'
+        self.assertEqual(modeldict['lastname'].value(), 'Shuttleworth')
+
+        modeldict = ModelDict(db=db)
+        modeldict({'id': 2, 'firstname': 'Bean'})
+
+        db.commit()
+
+    def test_modellist_batch(self):
+        queries = []
+
+        # LIST MODEL: QUERY DATABASE FOR RECORDS
+        q = {}
+        q['query'] = "SELECT firstname, lastname, submodel, id FROM Model"
+        testtable = []
+        testrow = {}
+        testtable.append(testrow)
+        testrow['id'] = 1
+        testrow['firstname'] = 'John'
+        testrow['lastname'] = 'Doe'
+        q['result'] = testtable
+        queries.append(q)
+
+        # LIST MODEL: ONE UPDATE FOR EXISTING ROW
+        q = {}
+        q['query'] = "UPDATE Model SET firstname=%s,lastname=%s WHERE id = %s"
+        q['values'] = ['Jane', 'Smith', 1]
+        queries.append(q)
+
+        # LIST MODEL: CHILD INSERTED BEFORE PARENT
+        q = {}
+        q['query'] = "INSERT INTO SubModel (age) VALUES (%s)"
+        q['values'] = [43,]
+        q['last_row_id'] = 43
+        queries.append(q)
+
+        q = {}
+        q['query'] = "INSERT INTO Model (firstname,lastname,submodel) VALUES (%s,%s,%s)"
+        q['values'] = ['Mark', 'Shuttleworth', 43]
+        q['last_row_id'] = 2
+        queries.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+
+        class SubModel(nfw.ModelDict):
+            age = nfw.Model.Integer(required=True)
+
+        class Model(nfw.Model):
+            firstname = nfw.Model.Text(required=True)
+            lastname = nfw.Model.Text(required=True)
+            submodel = SubModel(db=db, foreign_key='id')
+
+        model = Model(db=db)
+        model.query()
+
+        with model.batch():
+            model[0]['firstname'] = 'Jane'
+            model[0]['lastname'] = 'Smith'
+            model.append({'firstname': 'Mark'})
+            model[1]['lastname'] = 'Shuttleworth'
+            model[1]['submodel'] = {'age': 43}
+
+        self.assertEqual(model[1]['id'].value(), 2)
+        self.assertEqual(model[1]['submodel']['id'].value(), 43)
+
+        db.commit()
+
+    def test_modellist_eager(self):
+        queries = []
+
+        # LIST MODEL: QUERY DATABASE FOR RECORDS
+        q = {}
+        q['query'] = "SELECT firstname, submodel, id FROM Model"
+        testtable = []
+        for (i, submodel) in enumerate([22, 23, 22]):
+            testrow = {}
+            testrow['id'] = i
+            testrow['firstname'] = 'John'
+            testrow['submodel'] = submodel
+            testtable.append(testrow)
+        q['result'] = testtable
+        queries.append(q)
+
+        # LIST MODEL: ONE QUERY FOR ALL RELATED RECORDS
+        q = {}
+        q['query'] = "SELECT age, id FROM SubModel WHERE id IN (%s,%s)"
+        q['values'] = [22, 23]
+        testtable = []
+        for age in [22, 23]:
+            testrow = {}
+            testrow['id'] = age
+            testrow['age'] = age
+            testtable.append(testrow)
+        q['result'] = testtable
+        queries.append(q)
+
+        # LIST MODEL: CHANGED RELATIONS ARE QUERIED
+        for i in range(2):
+            q = {}
+            q['query'] = "SELECT age, id FROM SubModel WHERE id = %s"
+            q['values'] = [23]
+            q['result'] = [{'id': 23, 'age': 23}]
+            queries.append(q)
+
+        q = {}
+        q['query'] = "UPDATE Model SET submodel=%s WHERE id = %s"
+        q['values'] = [23, 2]
+        queries.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+
+        class SubModel(nfw.ModelDict):
+            age = nfw.Model.Integer(required=True)
+
+        class Model(nfw.Model):
+            firstname = nfw.Model.Text(required=True)
+            submodel = SubModel(db=db, foreign_key='id')
+
+        model = Model(db=db)
+        model.query(eager=['submodel'])
+
+        self.assertEqual(model[0]['submodel']['age'].value(), 22)
+        self.assertEqual(model[1]['submodel']['age'].value(), 23)
+        self.assertEqual(model[2]['submodel']['age'].value(), 22)
+
+        model[2]['submodel'] = 23
+        self.assertEqual(model[2]['submodel']['age'].value(), 23)
+
+        db.commit()
+
+    def test_modellist_paging(self):
+        queries = []
+
+        # LIST MODEL: OFFSET PAGE
+        q = {}
+        q['query'] = ("SELECT firstname, id FROM Model ORDER BY id" +
+                      " LIMIT %s OFFSET %s")
+        q['values'] = [3, 2]
+        testtable = []
+        for i in [3, 4, 5]:
+            testrow = {}
+            testrow['id'] = i
+            testrow['firstname'] = 'John'
+            testtable.append(testrow)
+        q['result'] = testtable
+        queries.append(q)
+
+        # LIST MODEL: KEYSET PAGE
+        q = {}
+        q['query'] = "SELECT firstname, id FROM Model WHERE id > %s" +\
+                     " ORDER BY id LIMIT %s"
+        q['values'] = [4, 3]
+        testtable = []
+        for i in [5, 6]:
+            testrow = {}
+            testrow['id'] = i
+            testrow['firstname'] = 'John'
+            testtable.append(testrow)
+        q['result'] = testtable
+        queries.append(q)
+
+        # LIST MODEL: KEYSET PAGE ON NON UNIQUE COLUMN
+        q = {}
+        q['query'] = "SELECT firstname, id FROM Model" +\
+                     " WHERE (firstname > %s OR (firstname = %s AND id > %s))" +\
+                     " ORDER BY firstname, id LIMIT %s"
+        q['values'] = ['John', 'John', 4, 2]
+        testtable = []
+        for i in [5, 6]:
+            testrow = {}
+            testrow['id'] = i
+            testrow['firstname'] = 'John'
+            testtable.append(testrow)
+        q['result'] = testtable
+        queries.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+
+        class Model(nfw.Model):
+            firstname = nfw.Model.Text(required=True)
+
+        model = Model(db=db)
+
+        page = model.page(2, size=2)
+        self.assertEqual(len(page), 2)
+        self.assertEqual(page.next, 3)
+
+        page = model.seek(after=4, size=2)
+        self.assertEqual(len(page), 2)
+        self.assertEqual(page.next, None)
+
+        page = model.seek(after=('John', 4), size=1, key='firstname')
+        self.assertEqual(len(page), 1)
+        self.assertEqual(page.next, ('John', 5))
+
+        db.commit()
+
+    def test_modellist_paging_query(self):
+        queries = []
+
+        # LIST MODEL: ORDER BY IN A VALUE IS NOT AN ORDER
+        q = {}
+        q['query'] = ("SELECT firstname, id FROM Model" +
+                      " WHERE firstname != 'order by' ORDER BY id" +
+                      " LIMIT %s OFFSET %s")
+        q['values'] = [3, 0]
+        q['result'] = []
+        queries.append(q)
+
+        # LIST MODEL: KEYSET PAGE ON THE MODEL QUERY
+        q = {}
+        q['query'] = ("SELECT firstname, id FROM Model" +
+                      " WHERE (firstname != 'order by' OR id = 1)" +
+                      " AND (firstname > %s OR (firstname = %s AND id > %s))" +
+                      " ORDER BY firstname, id LIMIT %s")
+        q['values'] = ['John', 'John', 4, 2]
+        q['result'] = []
+        queries.append(q)
+
+        # LIST MODEL: KEYSET PAGE ON AN ORDERED MODEL QUERY
+        q = {}
+        q['query'] = ("SELECT * FROM (SELECT firstname, id FROM Model" +
+                      " ORDER BY firstname) AS seek WHERE id > %s" +
+                      " ORDER BY id LIMIT %s")
+        q['values'] = [4, 2]
+        q['result'] = []
+        queries.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+
+        class Model(nfw.Model):
+            firstname = nfw.Model.Text(required=True)
+
+            class Meta(object):
+                db_query = ("SELECT firstname, id FROM Model" +
+                            " WHERE firstname != 'order by' OR id = 1")
+
+        class Ordered(nfw.Model):
+            firstname = nfw.Model.Text(required=True)
+
+            class Meta(object):
+                db_table = 'Model'
+                db_query = "SELECT firstname, id FROM Model ORDER BY firstname"
+
+        model = Model(db=db)
+        sql = "SELECT firstname, id FROM Model WHERE firstname != 'order by'"
+        self.assertEqual(model.page(1, size=2, sql=sql).next, None)
+        page = model.seek(after=('John', 4), size=1, key='firstname')
+        self.assertEqual(page.next, None)
+        self.assertRaises(nfw.Error, model.seek, after=4, key='firstname')
+
+        model = Ordered(db=db)
+        self.assertEqual(model.seek(after=4, size=1).next, None)
+
+        db.commit()
+
+    def test_modellist_compact(self):
+        queries = []
+
+        # LIST MODEL: QUERY DATABASE FOR COMPACT RECORDS
+        q = {}
+        q['query'] = "SELECT firstname, lastname, id FROM Model"
+        testtable = []
+        for i in range(2):
+            testrow = {}
+            testrow['id'] = i
+            testrow['firstname'] = 'John'
+            testrow['lastname'] = 'Doe'
+            testtable.append(testrow)
+        q['result'] = testtable
+        queries.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+
+        class Model(nfw.Model):
+            firstname = nfw.Model.Text(required=True)
+            lastname = nfw.Model.Text(required=True)
+
+        model = Model(db=db)
+        model.query(compact=True)
+
+        self.assertEqual(model[1]['firstname'].value(), 'John')
+        self.assertEqual(model[1]['id'].value(), 1)
+        self.assertIs(type(model[0]), type(model[1]))
+        self.assertRaises(nfw.Error, model[0].__setitem__, 'firstname', 'Jane')
+        self.assertRaises(nfw.Error, model.__setitem__, 0,
+                          {'firstname': 'Jane'})
+        with self.assertRaises(nfw.Error):
+            with model.batch():
+                pass
+        self.assertEqual(json.loads(model[0].dump_json()),
+                         {"firstname": "John", "lastname": "Doe", "id": 0})
+
+        db.commit()
+
+    def test_model_declared_fields(self):
+        class SubModel(nfw.ModelDict):
+            name = nfw.Model.Text()
+
+        class ModelDict(nfw.ModelDict):
+            firstname = nfw.Model.Text(required=True)
+            submodel = SubModel()
+
+        first = ModelDict()
+        second = ModelDict()
+        self.assertIs(first._declared_fields, second._declared_fields)
+        self.assertEqual(list(first._declared_fields),
+                         ['firstname', 'submodel'])
+
+        first['submodel'] = {'name': 'John'}
+        second['submodel'] = {'name': 'Jane'}
+        self.assertEqual(first['submodel']['name'].value(), 'John')
+        self.assertEqual(second['submodel']['name'].value(), 'Jane')
+
+    def test_modellist_json(self):
+        class SubModel(nfw.ModelDict):
+            name = nfw.Model.Text()
+
+        class Model(nfw.Model):
+            firstname = nfw.Model.Text(required=True)
+            age = nfw.Model.Integer()
+            submodel = SubModel()
+
+        model = Model()
+        for i in range(3):
+            model.append({'firstname': 'John', 'age': i,
+                          'submodel': {'name': 'Doe'}})
+
+        expected = [{'firstname': 'John', 'age': 0,
+                     'submodel': {'name': 'Doe'}},
+                    {'firstname': 'John', 'age': 1,
+                     'submodel': {'name': 'Doe'}},
+                    {'firstname': 'John', 'age': 2,
+                     'submodel': {'name': 'Doe'}}]
+        self.assertEqual(json.loads(model.dump_json()), expected)
+        self.assertEqual(json.loads(model.dump_json(use_ujson=True)),
+                         expected)
+        # The same output as json.dumps() unless ujson is requested.
+        self.assertEqual(model.dump_json(), json.dumps(model.to_python()))
+        self.assertEqual(json.loads(''.join(model.iter_json(batch=2))),
+                         expected)
+        self.assertEqual(''.join(model.iter_json(batch=2)),
+                         json.dumps(model.to_python()))
+        self.assertEqual(''.join(model.iter_json(rows=[])), '[]')
+
+        row = nfw.model.row_class(('created',))
+        self.assertEqual(row([datetime(2016, 1, 2, 3, 4, 5)]).to_python(),
+                         {'created': '2016/01/02 03:04:05'})
+
+        loaded = Model()
+        loaded.load_json(model.dump_json())
+        self.assertEqual(len(loaded.value()), 3)
+        self.assertEqual(loaded[2]['age'].value(), 2)
+
+    def test_modellist_cache(self):
+        queries = []
+
+        # LIST MODEL: QUERY DATABASE ONCE, THEN FROM THE CACHE
+        q = {}
+        q['query'] = "SELECT firstname, id FROM Cached"
+        q['result'] = [{'id': 1, 'firstname': 'John'}]
+        queries.append(q)
+
+        # LIST MODEL: UPDATE CLEARS THE CACHE
+        q = {}
+        q['query'] = "UPDATE Cached SET firstname=%s WHERE id = %s"
+        q['values'] = ['Jane', 1]
+        queries.append(q)
+
+        # LIST MODEL: UNCOMMITTED WRITES BYPASS THE CACHE
+        q = {}
+        q['query'] = "SELECT firstname, id FROM Cached"
+        q['result'] = [{'id': 1, 'firstname': 'Jane'}]
+        queries.append(q)
+
+        # LIST MODEL: QUERY DATABASE AGAIN AFTER ROLLBACK
+        q = {}
+        q['query'] = "SELECT firstname, id FROM Cached"
+        q['result'] = [{'id': 1, 'firstname': 'John'}]
+        queries.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+
+        class Model(nfw.Model):
+            class Meta:
+                db_table = 'Cached'
+                cache = 'local'
+                cache_ttl = 60
+
+            firstname = nfw.Model.Text(required=True)
+
+        model = Model(db=db)
+        model.query()
+        model.query()
+        self.assertEqual(model[0]['firstname'].value(), 'John')
+
+        model[0]['firstname'] = 'Jane'
+        model.query()
+        self.assertEqual(model[0]['firstname'].value(), 'Jane')
+        db.rollback()
+
+        model.query()
+        model.query()
+        self.assertEqual(model[0]['firstname'].value(), 'John')
+        db.commit()
+
+    def test_modellist_cache_commit(self):
+        queries = []
+
+        # LIST MODEL: QUERY DATABASE
+        q = {}
+        q['query'] = "SELECT firstname, id FROM CachedCommit"
+        q['result'] = [{'id': 1, 'firstname': 'John'}]
+        queries.append(q)
+
+        # LIST MODEL: UPDATE
+        q = {}
+        q['query'] = "UPDATE CachedCommit SET firstname=%s WHERE id = %s"
+        q['values'] = ['Jane', 1]
+        queries.append(q)
+
+        # OTHER CONNECTION: READS THE ROWS COMMITTED BEFORE THE UPDATE
+        other = []
+        q = {}
+        q['query'] = "SELECT firstname, id FROM CachedCommit"
+        q['result'] = [{'id': 1, 'firstname': 'John'}]
+        other.append(q)
+
+        # OTHER CONNECTION: QUERY DATABASE AGAIN AFTER COMMIT
+        q = {}
+        q['query'] = "SELECT firstname, id FROM CachedCommit"
+        q['result'] = [{'id': 1, 'firstname': 'Jane'}]
+        other.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+        other_db = nfw.mysql.Testing(other)
+
+        class Model(nfw.Model):
+            class Meta:
+                db_table = 'CachedCommit'
+                cache = 'local'
+
+            firstname = nfw.Model.Text(required=True)
+
+        model = Model(db=db)
+        model.query()
+        model[0]['firstname'] = 'Jane'
+
+        reader = Model(db=other_db)
+        reader.query()
+        self.assertEqual(reader[0]['firstname'].value(), 'John')
+
+        db.commit()
+        reader.query()
+        self.assertEqual(reader[0]['firstname'].value(), 'Jane')
+        other_db.commit()
+
+    def test_modellist_uncached_commit(self):
+        queries = []
+
+        # LIST MODEL: INSERT
+        q = {}
+        q['query'] = "INSERT INTO Uncached (firstname) VALUES (%s)"
+        q['values'] = ['John']
+        q['last_row_id'] = 1
+        queries.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+
+        class Model(nfw.Model):
+            class Meta:
+                db_table = 'Uncached'
+
+            firstname = nfw.Model.Text(required=True)
+
+        # WRITES TO TABLES WITHOUT A CACHE ADD NO COMMIT CALLBACK
+        model = Model(db=db)
+        model.append({'firstname': 'John'})
+        self.assertEqual(len(db._on_commit), 0)
+        db.commit()
+
+    def test_modellist_cache_redis(self):
+        class Redis(object):
+            def __init__(self):
+                self.data = {}
+                self.ttl = {}
+
+            def get(self, name):
+                return self.data.get(name)
+
+            def psetex(self, name, ttl, value):
+                self.data[name] = value
+                self.ttl[name] = ttl
+
+            def incr(self, name):
+                self.data[name] = int(self.data.get(name, 0)) + 1
+
+        queries = []
+
+        # LIST MODEL: QUERY DATABASE ONCE, THEN FROM THE CACHE
+        q = {}
+        q['query'] = "SELECT firstname, id FROM CachedRedis"
+        q['result'] = [{'id': 1, 'firstname': 'John'}]
+        queries.append(q)
+
+        # LIST MODEL: QUERY DATABASE AGAIN AFTER CLEAR
+        q = {}
+        q['query'] = "SELECT firstname, id FROM CachedRedis"
+        q['result'] = [{'id': 1, 'firstname': 'Jane'}]
+        queries.append(q)
+
+        # GET DATABASE INTERFACE
+        db = nfw.mysql.Testing(queries)
+
+        class Model(nfw.Model):
+            class Meta:
+                db_table = 'CachedRedis'
+                cache = 'redis'
+                cache_ttl = 30
+
+            firstname = nfw.Model.Text(required=True)
+
+        redis = nfw.redis
+        nfw.redis = Redis()
+        try:
+            model = Model(db=db)
+            model.query()
+            model.query()
+            self.assertEqual(model[0]['firstname'].value(), 'John')
+            self.assertEqual(nfw.redis.ttl.values(), [30000])
+
+            model._db.clear_cache()
+            self.assertEqual(nfw.redis.get('nfw:query:CachedRedis'), 1)
+            model.query()
+            self.assertEqual(model[0]['firstname'].value(), 'Jane')
+            self.assertEqual(len(nfw.redis.ttl), 2)
+        finally:
+            nfw.redis = redis
+        db.commit()
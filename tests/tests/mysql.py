@@ -0,0 +1,388 @@
+# Neutrino Framework
+#
+# Copyright (c) 2016, Christiaan Frans Rademan
+# All rights reserved.
+#
+# LICENSE: (BSD3-Clause)
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENTSHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import logging
+import threading
+import time
+import unittest
+
+import MySQLdb
+
+import nfw
+
+log = logging.getLogger(__name__)
+
+class Cursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.lastrowid = None
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        if self.conn.failed is True:
+            raise MySQLdb.OperationalError(2006, 'MySQL server has gone away')
+        self.conn.log.append(query)
+        if 'unknown' in query:
+            raise MySQLdb.OperationalError(1054, 'Unknown column')
+        if 'duplicate' in query:
+            raise MySQLdb.IntegrityError(1062, 'Duplicate entry')
+
+    def executemany(self, query, params):
+        self.execute(query, params)
+
+    def fetchall(self):
+        return ()
+
+    def close(self):
+        pass
+
+
+class Connection(object):
+    """Records the statements sent on a fake MySQLdb connection."""
+    def __init__(self, host):
+        self.host = host
+        self.log = []
+        self.failed = False
+        self.closed = False
+        self.pings = 0
+        self.thread_id = 1
+
+    def cursor(self, cls=None):
+        return Cursor(self)
+
+    def commit(self):
+        self.log.append('COMMIT')
+
+    def rollback(self):
+        self.log.append('ROLLBACK')
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if self.failed is True:
+            raise MySQLdb.OperationalError(2006, 'MySQL server has gone away')
+
+    def close(self):
+        self.closed = True
+
+    def get_server_info(self):
+        return '5.7'
+
+    def get_host_info(self):
+        return self.host
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class Mysql(unittest.TestCase):
+    def setUp(self):
+        self.connections = []
+        self._connect = nfw.mysql.connect
+        self._time = nfw.mysql.time
+        self.clock = Clock()
+
+        self.down = set()
+
+        def connect(host, username, password, database):
+            if host in self.down:
+                raise MySQLdb.OperationalError(2003, "Can't connect")
+            conn = Connection(host)
+            self.connections.append(conn)
+            return conn
+        nfw.mysql.connect = connect
+
+    def tearDown(self):
+        nfw.Mysql.close_all()
+        nfw.mysql.connect = self._connect
+        nfw.mysql.time = self._time
+        for key in list(nfw.Mysql._pool):
+            if key.startswith('test'):
+                del nfw.Mysql._pool[key]
+                nfw.Mysql._down.pop(key, None)
+        for name in list(nfw.Mysql._credentials):
+            if name.startswith('test'):
+                del nfw.Mysql._credentials[name]
+
+    def pool(self, **kwargs):
+        nfw.Mysql._credentials['testpool'] = {}
+        return nfw.mysql.Pool('testpool', **kwargs)
+
+    def test_pool_max(self):
+        pool = self.pool(max_size=2, timeout=0)
+        first = pool.get()
+        second = pool.get()
+        self.assertRaises(nfw.HTTPServiceUnavailable, pool.get)
+        pool.put(first)
+        self.assertTrue(pool.get() is first)
+        stats = pool.stats()
+        self.assertEqual(stats['in_use'], 2)
+        self.assertEqual(stats['idle'], 0)
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(stats['waits'], 0)
+
+        # Waits for a connection until the timeout.
+        pool.configure(timeout=0.01)
+        self.assertRaises(nfw.HTTPServiceUnavailable, pool.get)
+        self.assertEqual(pool.stats()['waits'], 1)
+
+    def test_pool_wait(self):
+        pool = self.pool(max_size=1, timeout=10)
+        conn = pool.get()
+        got = []
+        waiting = threading.Thread(target=lambda: got.append(pool.get()))
+        waiting.start()
+        while pool.stats()['waits'] == 0:
+            time.sleep(0.01)
+        self.assertEqual(got, [])
+        pool.put(conn)
+        waiting.join()
+        self.assertTrue(got[0] is conn)
+        stats = pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['waits'], 1)
+        self.assertTrue(stats['wait_time'] > 0)
+
+    def test_pool_evict(self):
+        nfw.mysql.time = self.clock
+        pool = self.pool(min_size=1, idle_timeout=300, max_lifetime=3600)
+        connections = [pool.get() for i in range(3)]
+        for conn in connections:
+            pool.put(conn)
+        self.assertEqual(pool.stats()['idle'], 3)
+
+        # Idle connections above min_size are closed.
+        self.clock.now += 301
+        conn = pool.get()
+        self.assertEqual(len([c for c in connections if c.closed]), 2)
+        self.assertFalse(conn.closed)
+
+        # Connections older than max_lifetime are not returned to the
+        # pool, or closed when idle.
+        self.clock.now += 3300
+        pool.put(conn)
+        self.assertTrue(conn.closed)
+        old = pool.get()
+        pool.put(old)
+        self.clock.now += 3601
+        conn = pool.get()
+        self.assertTrue(old.closed)
+        self.assertFalse(conn.closed)
+        stats = pool.stats()
+        self.assertEqual(stats['created'], 5)
+        self.assertEqual(stats['destroyed'], 4)
+        self.assertEqual(stats['in_use'], 1)
+        self.assertEqual(stats['idle'], 0)
+
+    def test_pool_ping(self):
+        nfw.mysql.time = self.clock
+        pool = self.pool(ping_interval=30)
+        conn = pool.get()
+        pool.put(conn)
+        self.clock.now += 10
+        self.assertTrue(pool.get() is conn)
+        self.assertEqual(conn.pings, 0)
+        pool.put(conn)
+        self.clock.now += 31
+        self.assertTrue(pool.get() is conn)
+        self.assertEqual(conn.pings, 1)
+
+        # Connections failing the ping are closed and replaced.
+        pool.put(conn)
+        conn.failed = True
+        self.clock.now += 31
+        replaced = pool.get()
+        self.assertFalse(replaced is conn)
+        self.assertTrue(conn.closed)
+        stats = pool.stats()
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(stats['destroyed'], 1)
+        self.assertEqual(stats['in_use'], 1)
+
+    def test_failed_statement(self):
+        db = nfw.Mysql('test', database='test')
+        self.assertRaises(MySQLdb.IntegrityError, db.execute,
+                          "INSERT INTO duplicate (id) VALUES (1)")
+        self.assertTrue(db.in_transaction())
+        nfw.Mysql.close_all()
+        conn = self.connections[0]
+        self.assertEqual(conn.log, ["INSERT INTO duplicate (id) VALUES (1)",
+                                    'ROLLBACK'])
+
+        # Also when ending the transaction with rollback().
+        db = nfw.Mysql('test')
+        self.assertRaises(MySQLdb.IntegrityError, db.executemany,
+                          "INSERT INTO duplicate (id) VALUES (%s)", [(1,)])
+        db.rollback()
+        self.assertEqual(conn.log[-1], 'ROLLBACK')
+        self.assertEqual(len(self.connections), 1)
+
+        # Nothing is sent when no statement ran.
+        db = nfw.Mysql('test')
+        db.execute("SELECT id FROM test")
+        db.commit()
+        db.commit()
+        nfw.Mysql.close_all()
+        self.assertEqual(conn.log[-2:], ["SELECT id FROM test", 'COMMIT'])
+
+    def hosts(self):
+        return [conn.host for conn in self.connections]
+
+    def test_replica_reads(self):
+        nfw.mysql.time = self.clock
+        db = nfw.Mysql('testreplica', host='primary', database='test',
+                       replicas='replica1, replica2', replica_retry=30)
+        db.execute("SELECT id FROM test")
+        db.execute("SELECT id FROM test")
+        self.assertEqual(len(self.connections), 1)
+        replica = self.connections[0]
+        self.assertTrue(replica.host in ('replica1', 'replica2'))
+        self.assertEqual(len(replica.log), 2)
+        self.assertFalse(db.pinned())
+        nfw.Mysql.close_all()
+
+        # Writes pin the request to the primary.
+        db = nfw.Mysql('testreplica')
+        db.execute("UPDATE test SET name = %s", ('John',))
+        self.assertTrue(db.pinned())
+        db.execute("SELECT id FROM test")
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(self.connections[1].host, 'primary')
+        self.assertEqual(self.connections[1].log,
+                         ["UPDATE test SET name = %s", "SELECT id FROM test"])
+        nfw.Mysql.close_all()
+
+        # Locking reads run on the primary.
+        db = nfw.Mysql('testreplica')
+        db.execute("SELECT id FROM test FOR UPDATE")
+        self.assertTrue(db.pinned())
+        db.execute("SELECT id FROM test")
+        self.assertEqual(self.connections[1].log[-3:],
+                         ['ROLLBACK', "SELECT id FROM test FOR UPDATE",
+                          "SELECT id FROM test"])
+        nfw.Mysql.close_all()
+
+        # The pin ends with the request.
+        db = nfw.Mysql('testreplica')
+        self.assertFalse(db.pinned())
+        db.execute("SELECT id FROM test")
+        self.assertNotEqual(self.connections[-1].host, 'primary')
+        self.assertEqual(self.connections[-1].log[-1], "SELECT id FROM test")
+        self.assertEqual(self.connections[1].log[-1], 'ROLLBACK')
+
+    def test_replica_fallback(self):
+        nfw.mysql.time = self.clock
+        db = nfw.Mysql('testfallback', host='primary', database='test',
+                       replicas='replica1, replica2', replica_retry=30)
+
+        # A replica lost during the request is skipped, the read runs on
+        # the primary.
+        db.execute("SELECT id FROM test")
+        replica = self.connections[0]
+        replica.failed = True
+        db.execute("SELECT name FROM test")
+        self.assertTrue(replica.closed)
+        self.assertEqual(self.hosts()[-1], 'primary')
+        self.assertEqual(self.connections[-1].log, ["SELECT name FROM test"])
+        nfw.Mysql.close_all()
+
+        # Until replica_retry passed, reads use the other replica.
+        other = {'replica1': 'replica2', 'replica2': 'replica1'}[replica.host]
+        for i in range(2):
+            db = nfw.Mysql('testfallback')
+            db.execute("SELECT id FROM test")
+            nfw.Mysql.close_all()
+        self.assertEqual(self.hosts(), [replica.host, 'primary', other])
+
+        # Without a replica available, reads run on the primary.
+        self.connections[-1].failed = True
+        self.down.add(replica.host)
+        self.clock.now += 10
+        db = nfw.Mysql('testfallback')
+        db.execute("SELECT id FROM test")
+        nfw.Mysql.close_all()
+        self.clock.now += 25
+        db = nfw.Mysql('testfallback')
+        db.execute("SELECT id FROM test")
+        nfw.Mysql.close_all()
+        self.assertEqual(self.connections[1].log[-2:],
+                         ["SELECT id FROM test", 'ROLLBACK'])
+        self.assertEqual(len(self.connections), 3)
+
+        # Replicas are retried after replica_retry seconds.
+        self.down.clear()
+        self.clock.now += 30
+        db = nfw.Mysql('testfallback')
+        db.execute("SELECT id FROM test")
+        self.assertEqual(len(self.connections), 4)
+        self.assertTrue(self.connections[3].host in ('replica1', 'replica2'))
+
+    def test_replica_error(self):
+        db = nfw.Mysql('testreplicaerror', host='primary', database='test',
+                       replicas='replica1')
+
+        # Errors other than a lost connection are raised, the replica
+        # stays in use.
+        self.assertRaises(MySQLdb.OperationalError, db.execute,
+                          "SELECT unknown FROM test")
+        db.execute("SELECT id FROM test")
+        self.assertEqual(self.hosts(), ['replica1'])
+        self.assertFalse(self.connections[0].closed)
+
+    def test_insert_many(self):
+        queries = []
+        q = {}
+        q['query'] = "INSERT INTO test (name) VALUES (%s),(%s),(%s)"
+        q['values'] = ['a', 'b', 'c']
+        q['last_row_id'] = 11
+        queries.append(q)
+
+        q = {}
+        q['query'] = "SELECT @@auto_increment_increment AS increment"
+        q['result'] = [{'increment': 5}]
+        queries.append(q)
+
+        q = {}
+        q['query'] = "INSERT INTO test (name) VALUES (%s),(%s)"
+        q['values'] = ['d', 'e']
+        q['last_row_id'] = 31
+        queries.append(q)
+
+        db = nfw.mysql.Testing(queries)
+        ids = nfw.mysql.insert_many(db, 'test', ('name',),
+                                    [('a',), ('b',), ('c',), ('d',), ('e',)],
+                                    max_packet=21)
+        self.assertEqual(ids, [11, 16, 21, 31, 36])
+        db.commit()
@@ -0,0 +1,136 @@
+# Neutrino Framework
+#
+# Copyright (c) 2016, Christiaan Frans Rademan
+# All rights reserved.
+#
+# LICENSE: (BSD3-Clause)
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENTSHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+from email.utils import formatdate
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import nfw
+
+log = logging.getLogger(__name__)
+
+class Response(unittest.TestCase):
+    def test_chunks(self):
+        resp = nfw.Response(chunk_size=4)
+        resp.write('Hello ')
+        resp.write(u'W\xf6rld')
+        self.assertEqual(resp.content_length, 12)
+        self.assertFalse(resp.streaming)
+        self.assertEqual(list(resp), ['Hell', 'o W\xc3', '\xb6rld'])
+
+    def test_stream(self):
+        resp = nfw.Response()
+        resp.body = iter(['Hello', '', u' W\xf6rld'])
+        self.assertTrue(resp.streaming)
+        self.assertEqual(resp.content_length, None)
+        self.assertRaises(nfw.Error, resp.write, 'more')
+        self.assertEqual(list(resp), ['Hello', ' W\xc3\xb6rld'])
+
+        resp.stream(iter(['Hello']), 5)
+        self.assertEqual(resp.content_length, 5)
+
+    def test_clear_stream(self):
+        closed = []
+
+        def rows():
+            try:
+                yield 'row 1'
+                yield 'row 2'
+            finally:
+                closed.append(True)
+
+        resp = nfw.Response()
+        resp.body = rows()
+        chunks = iter(resp)
+        self.assertEqual(next(chunks), 'row 1')
+
+        # An error replaces the started stream.
+        resp.body = 'Error'
+        self.assertEqual(closed, [True])
+        self.assertFalse(resp.streaming)
+        self.assertEqual(list(resp), ['Error'])
+
+        resp.body = rows()
+        iter(resp).next()
+        resp.close()
+        self.assertEqual(closed, [True, True])
+
+    def test_file(self):
+        path = tempfile.mkdtemp()
+        try:
+            name = os.path.join(path, 'file.txt')
+            with open(name, 'wb') as f:
+                f.write('Hello World')
+            stat = os.stat(name)
+
+            resp = nfw.Response(chunk_size=4)
+            resp.file(name)
+            self.assertTrue(resp.has_file)
+            self.assertEqual(resp.content_length, 11)
+            self.assertEqual(resp.headers['Content-Type'], 'text/plain')
+            self.assertEqual(resp.headers['ETag'],
+                             '"%x-%x"' % (int(stat.st_mtime), 11))
+            self.assertEqual(resp.headers['Last-Modified'],
+                             formatdate(stat.st_mtime, usegmt=True))
+            self.assertEqual(resp.headers['Accept-Ranges'], 'bytes')
+            self.assertEqual(list(resp), ['Hell', 'o Wo', 'rld'])
+            self.assertRaises(nfw.Error, resp.write, 'more')
+
+            f = open(name, 'rb')
+            resp.file(f, nfw.APPLICATION_OCTET_STREAM)
+            self.assertEqual(resp.headers['Content-Type'],
+                             nfw.APPLICATION_OCTET_STREAM)
+            resp.clear()
+            self.assertTrue(f.closed)
+            self.assertFalse(resp.has_file)
+        finally:
+            shutil.rmtree(path)
+
+    def test_parse_range(self):
+        parse_range = nfw.response.parse_range
+        self.assertEqual(parse_range('bytes=0-4', 10), (0, 4))
+        self.assertEqual(parse_range('bytes=5-', 10), (5, 9))
+        self.assertEqual(parse_range('bytes=8-20', 10), (8, 9))
+        self.assertEqual(parse_range('bytes=-3', 10), (7, 9))
+        self.assertEqual(parse_range('bytes=-20', 10), (0, 9))
+        # Not satisfiable.
+        self.assertEqual(parse_range('bytes=10-', 10), False)
+        self.assertEqual(parse_range('bytes=-0', 10), False)
+        # Multiple ranges and invalid headers are ignored.
+        self.assertEqual(parse_range('bytes=0-1,3-4', 10), None)
+        self.assertEqual(parse_range('items=0-4', 10), None)
+        self.assertEqual(parse_range('bytes=5-2', 10), None)
+        self.assertEqual(parse_range('bytes=5', 10), None)
+        self.assertEqual(parse_range('bytes=a-b', 10), None)
+        self.assertEqual(parse_range('bytes=--5', 10), None)
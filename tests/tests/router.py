@@ -39,6 +39,11 @@ import nfw
 
 log = logging.getLogger(__name__)
 
+class App(object):
+    """Application attributes used by nfw.Request."""
+    def __init__(self):
+        self.context = {}
+
 class Routes(unittest.TestCase):
     def __init__(self, methodName):
         self.router = nfw.Router()
@@ -52,7 +57,8 @@ class Routes(unittest.TestCase):
         self.environ['REMOTE_ADDR'] = '127.0.0.1'
         self.environ['wsgi.input'] = StringIO()
         self.environ['QUERY_STRING'] = ''
-        self.req = nfw.Request(self.environ, self.config, self.session, self.router, self.logger)
+        self.req = nfw.Request(self.environ, self.config, self.session,
+                               self.router, self.logger, App())
         self.resp = nfw.Response()
 
         super(Routes, self).__init__(methodName)
@@ -101,3 +107,39 @@ class Routes(unittest.TestCase):
         self.router.add(nfw.HTTP_PUT, '/kwargs/{var1}/{var2}', self.view, 'kwargs_test:kwargs_test')
         kwargs = {'var1': 'test1', 'var2': 'test2'}
         r = self.route(nfw.HTTP_PUT, '/kwargs/test1/test2', 'kwargs_test:kwargs_test', kwargs)
+
+    def test_static_before_field(self):
+        self.router.add(nfw.HTTP_GET, '/static/{var1}', self.view, 'field_test:field_test')
+        self.router.add(nfw.HTTP_GET, '/static/list', self.view, 'static_test:static_test')
+        kwargs = {}
+        r = self.route(nfw.HTTP_GET, '/static/list', 'static_test:static_test', kwargs)
+        kwargs = {'var1': 'test1'}
+        r = self.route(nfw.HTTP_GET, '/static/test1', 'field_test:field_test', kwargs)
+
+    def test_duplicate(self):
+        self.router.add(nfw.HTTP_GET, '/dup/{var1}', self.view, 'dup_test:dup_test')
+        self.assertRaises(nfw.Error, self.router.add, nfw.HTTP_GET,
+                          '/dup/{var2}', self.view, 'dup_test:dup_test')
+
+    def test_converters(self):
+        self.router.add(nfw.HTTP_GET, '/typed/{var1:int}', self.view, 'int_test:int_test')
+        self.router.add(nfw.HTTP_GET, '/typed/{var1:slug}', self.view, 'slug_test:slug_test')
+        kwargs = {'var1': 10}
+        r = self.route(nfw.HTTP_GET, '/typed/10', 'int_test:int_test', kwargs)
+        kwargs = {'var1': 'test-1'}
+        r = self.route(nfw.HTTP_GET, '/typed/test-1', 'slug_test:slug_test', kwargs)
+        self.assertIsNone(self.router._match(nfw.HTTP_GET, 'typed/test 1'))
+        self.assertRaises(ValueError, self.router.add, nfw.HTTP_GET,
+                          '/typed/{var1:unknown}', self.view)
+
+    def test_cache(self):
+        self.router = nfw.Router(cache=2)
+        self.router.add(nfw.HTTP_GET, '/cache/{var1:int}', self.view, 'cache_test:cache_test')
+        kwargs = {'var1': 1}
+        r = self.route(nfw.HTTP_GET, '/cache/1', 'cache_test:cache_test', kwargs)
+        r = self.route(nfw.HTTP_GET, '/cache/1', 'cache_test:cache_test', kwargs)
+        stats = self.router.cache_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.router.add(nfw.HTTP_GET, '/cache', self.view, 'cache_test:cache_test')
+        self.assertEqual(self.router.cache_stats()['size'], 0)